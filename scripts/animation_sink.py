@@ -0,0 +1,100 @@
+import os
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+# Streaming animation writers fed straight from rendered figures.
+# Frames come from the Agg canvas buffer (figure_frame), so nothing is written as PNG and read back, and each frame is
+# encoded and dropped as soon as it arrives: memory stays at one frame however long the animation is.
+# GIF frames are each quantized to their own adaptive palette (like PIL's save_all does), written as a local color table
+# with PIL's GIF block encoder behind a single header, so colors that only show up in later frames are kept. MP4 goes through imageio (with its ffmpeg plugin) if installed.
+# Set frame_dir to also keep every frame as a PNG, like the frames/ folders animate_frames reads.
+
+# RGB pixels of a figure as drawn by the Agg canvas, shape (height, width, 3)
+def figure_frame(fig):
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())[..., :3]
+
+class GifEncoder:
+    def __init__(self, path, duration=500, loop=0):
+        self.path = path
+        self.tmp_path = path + f".{os.getpid()}.tmp"
+        self.duration = duration
+        self.loop = loop
+        self.num_frames = 0
+        self.file = open(self.tmp_path, "wb")
+
+    def add_frame(self, frame):
+        image = Image.fromarray(np.ascontiguousarray(frame))
+        indexed = image.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        if self.num_frames == 0:
+            # screen descriptor (with the first frame's palette as the global table) and the NETSCAPE loop extension
+            header, _ = GifImagePlugin.getheader(indexed.copy(), info={"loop": self.loop, "duration": self.duration, "optimize": False})
+            self.file.write(b"".join(header))
+        self.file.write(b"".join(GifImagePlugin.getdata(indexed, duration=self.duration, include_color_table=True)))
+        self.num_frames += 1
+
+    def close(self):
+        self.file.write(b";")  # GIF trailer
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+class Mp4Encoder:
+    def __init__(self, path, duration=500):
+        import imageio  # optional, only needed for mp4 output
+        self.path = path
+        self.tmp_path = path + f".{os.getpid()}.tmp.mp4"
+        self.writer = imageio.get_writer(self.tmp_path, fps=1000. / duration, macro_block_size=1)
+
+    def add_frame(self, frame):
+        self.writer.append_data(frame)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.writer.close()
+        os.remove(self.tmp_path)
+
+ENCODERS = {".gif": GifEncoder, ".mp4": Mp4Encoder}
+
+# an animation at path (encoder picked by its extension), duration ms per frame. use as a context manager so the
+# file only appears once every frame is in
+class AnimationSink:
+    def __init__(self, path, duration=500, frame_dir=None):
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in ENCODERS:
+            raise ValueError(f"unsupported animation format {extension}; use one of {list(ENCODERS)}")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.frame_dir = frame_dir
+        self.num_frames = 0
+        self.encoder = ENCODERS[extension](path, duration)
+
+    # frame: (height, width, 3) uint8 array (see figure_frame). frame_name names its PNG if frame_dir is set
+    def add_frame(self, frame, frame_name=None):
+        self.encoder.add_frame(frame)
+        if self.frame_dir is not None:
+            os.makedirs(self.frame_dir, exist_ok=True)
+            Image.fromarray(frame).save(os.path.join(self.frame_dir, frame_name or f"frame_{self.num_frames:02d}.png"))
+        self.num_frames += 1
+
+    def close(self):
+        if self.num_frames == 0:
+            self.encoder.abort()
+            raise ValueError(f"no frames were added to {self.path}")
+        self.encoder.close()
+        print(f"Saved animation to: {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.encoder.abort()
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import resource
+import argparse
+import subprocess
+from datetime import datetime
+import torch
+from render_scheduler import run_render_jobs
+from synthetic_data import SyntheticModel, write_synthetic_stats, write_synthetic_truth
+from model_registry import register_model
+from ic_store import open_ic_store
+from generate_forecast import get_device, get_initial_condition, get_noisy_input_on_device, run_inference, run_batched_inference
+from compute_error import compute_true_track, update_error_log, generate_global_error_dataset
+from error_stats import load_error_stats, stats_cache_path
+from plot_errors import plot_pixelwise_error_hists, plot_pixelwise_error_summary, plot_pixelwise_error_moments
+from visualize_forecast import global_render_jobs, local_render_jobs, visualize_local_trajectories_only
+from config import *
+
+# Offline benchmark of the pipeline stages on full-size synthetic data (see synthetic_data.py), with a CPU stand-in for
+# FCNv2, so performance can be measured without the weights, a GPU, or CDS access, and compared across revisions.
+# Every stage runs in a fresh process pointed at BENCHMARK_DIR through the FCNV2_* environment variables, so its
+# wall time, CPU time, and peak memory are its own (peak RSS includes the imports, which are reported separately).
+# Stages run in order and each one reads what the ones before it wrote.
+#   python benchmark.py run --scale small --output bench.json      # time every stage
+#   python benchmark.py run --stages rollout write --repeat 3       # only some stages (their inputs must exist: --keep)
+#   python benchmark.py compare baseline.json bench.json            # exit code 1 if a stage got slower or bigger
+
+BENCHMARK_SCALES = {
+    "smoke": {"timesteps": 2, "members": 1, "channels": ["msl"]},
+    "small": {"timesteps": 4, "members": 2, "channels": ["msl", "u10m", "v10m"]},
+    "full": {"timesteps": 15, "members": 8, "channels": ["msl", "u10m", "v10m"]},
+}
+BENCHMARK_STAGES = [
+    "synthetic_data", "input_load", "perturbation", "rollout", "write", "tracking",
+    "error_dataset", "stats", "rendering", "animation",
+]
+BENCHMARK_NOISE = 0.05      # noise level of the benchmarked members
+REGRESSION_THRESHOLD = 0.10     # relative increase of wall time or peak memory reported as a regression
+COMPARED_METRICS = ["wall_s", "peak_rss_mb", "cuda_peak_mb"]
+
+def benchmark_seeds(members):
+    return [int(seed) for seed in SEEDS[:members]]
+
+# make run_inference and run_batched_inference pick up the stand-in model instead of loading weights from MODEL_DIR
+def use_synthetic_model():
+    register_model(MODEL_DIR, get_device(), SyntheticModel())
+
+def stage_synthetic_data(members, channels):
+    write_synthetic_stats(MODEL_DIR)
+    write_synthetic_truth(TRUE_PATH, TIMESTEPS + 1)
+
+def stage_input_load(members, channels):
+    shutil.rmtree(IC_STORE_DIR, ignore_errors=True)
+    open_ic_store(TRUE_PATH)
+    get_initial_condition().clone()
+
+def stage_perturbation(members, channels):
+    length_km = CORRELATION_LENGTH_KM if PERTURBATION == "correlated" else None
+    get_noisy_input_on_device(BENCHMARK_NOISE, benchmark_seeds(members), get_device(), length_km)
+
+def stage_rollout(members, channels):
+    use_synthetic_model()
+    run_batched_inference(BENCHMARK_NOISE, benchmark_seeds(members), batch_size=members, mode=PERTURBATION)
+
+def stage_write(members, channels):
+    use_synthetic_model()
+    shutil.rmtree(FORECAST_CACHE_DIR, ignore_errors=True)   # a cache hit would skip the rollout
+    run_inference(mode=PERTURBATION, noise_prop=BENCHMARK_NOISE, seed=benchmark_seeds(1)[0], output_path=PRED_PATH)
+
+def stage_tracking(members, channels):
+    compute_true_track(TRUE_PATH, TIMESTEPS)
+    update_error_log({}, BENCHMARK_NOISE, benchmark_seeds(1)[0], TRUE_PATH, PRED_PATH, TIMESTEPS)
+
+def stage_error_dataset(members, channels):
+    generate_global_error_dataset(ERROR_DATAPATH, TRUE_PATH, PRED_PATH, TIMESTEPS)
+
+def stage_stats(members, channels):
+    if os.path.exists(stats_cache_path(ERROR_DATAPATH)):
+        os.remove(stats_cache_path(ERROR_DATAPATH))
+    load_error_stats(ERROR_DATAPATH, channels)
+
+def stage_rendering(members, channels):
+    plot_dir = os.path.join(PLOT_DIR, "errors")
+    for channel in channels:
+        channel_dir = os.path.join(plot_dir, channel)
+        plot_pixelwise_error_hists(channel_dir, ERROR_DATAPATH, channel, TIMESTEPS, "benchmark", f"{channel}_error_hist")
+        plot_pixelwise_error_summary(channel_dir, ERROR_DATAPATH, channel, TIMESTEPS, "benchmark", f"{channel}_error_summary")
+        plot_pixelwise_error_moments(channel_dir, ERROR_DATAPATH, channel, TIMESTEPS, "benchmark", f"{channel}_error_moments")
+    visualize_local_trajectories_only(plot_dir, TRUE_PATH, PRED_PATH, TIMESTEPS, "benchmark", "traj_only.png")
+
+# animations are rendered in this process (not on the render pool) so their cost shows up in this stage's numbers
+def stage_animation(members, channels):
+    animation_dir = os.path.join(PLOT_DIR, "animations")
+    jobs = local_render_jobs(
+        os.path.join(animation_dir, "local"), TRUE_PATH, PRED_PATH, BENCHMARK_NOISE, TIMESTEPS, "animated_local.gif",
+        "benchmark", "traj_only.png"
+    )[:1]
+    for channel in channels:
+        jobs += global_render_jobs(
+            os.path.join(animation_dir, "global"), PRED_PATH, channel, TIMESTEPS, "benchmark", channel, f"animated_{channel}.gif"
+        )
+    run_render_jobs(jobs, max_workers=0)
+
+STAGE_FUNCS = {name: globals()[f"stage_{name}"] for name in BENCHMARK_STAGES}
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.  # KiB on linux
+
+# run one stage in this process and write its measurements to result_path
+def measure_stage(name, members, channels, result_path):
+    device = get_device()
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    import_rss = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    STAGE_FUNCS[name](members, channels)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    result = {
+        "wall_s": time.perf_counter() - wall,
+        "cpu_s": time.process_time() - cpu,
+        "import_rss_mb": import_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "cuda_peak_mb": torch.cuda.max_memory_allocated(device) / 2 ** 20 if device.type == "cuda" else None,
+    }
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+# commit the benchmark ran at, marked dirty if the tree had local changes
+def git_revision():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=script_dir, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=script_dir, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if status.strip() else "")
+
+# run stages (each repeat in its own process) and write the results to output_path. the best of the repeats counts
+def run_benchmark(scale, stages=BENCHMARK_STAGES, repeat=1, output_path="benchmark.json", workdir=BENCHMARK_DIR, keep=False):
+    env = dict(os.environ)
+    env.update({
+        "FCNV2_HOME_PATH": workdir, "FCNV2_MODEL_DIR": os.path.join(workdir, "model"),
+        "FCNV2_ERA5_STATS_DIR": os.path.join(workdir, "model"), "FCNV2_TIMESTEPS": str(scale["timesteps"]),
+    })
+    os.makedirs(workdir, exist_ok=True)
+    results = {
+        "revision": git_revision(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "device": str(get_device()),
+        "scale": scale,
+        "repeat": repeat,
+        "stages": {},
+    }
+    failed = None
+    for name in stages:
+        runs = []
+        for _ in range(repeat):
+            result_path = os.path.join(workdir, f"{name}.result.json")
+            cmd = [
+                sys.executable, os.path.abspath(__file__), "stage", name,
+                "--members", str(scale["members"]), "--channels", *scale["channels"], "--result", result_path,
+            ]
+            print(f"Benchmarking {name}...")
+            if subprocess.run(cmd, env=env).returncode != 0:
+                failed = name
+                break
+            with open(result_path) as f:
+                runs.append(json.load(f))
+            os.remove(result_path)
+        if failed:
+            results["stages"][name] = {"error": "stage failed"}
+            break
+        best = min(runs, key=lambda run: run["wall_s"])
+        results["stages"][name] = {**best, "runs": [run["wall_s"] for run in runs]}
+        print(f"  {name}: {best['wall_s']:.2f} s wall, {best['cpu_s']:.2f} s cpu, {best['peak_rss_mb']:.0f} MB peak RSS")
+
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved benchmark results to {output_path}")
+    if not keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        raise RuntimeError(f"benchmark stage {failed} failed")
+    return results
+
+# stages whose metrics grew by more than threshold (relative) from baseline to current, as (stage, metric, old, new)
+def find_regressions(baseline, current, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    for name, stage in current["stages"].items():
+        old_stage = baseline["stages"].get(name)
+        if old_stage is None or "error" in old_stage or "error" in stage:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = old_stage.get(metric), stage.get(metric)
+            if old and new is not None and new > old * (1 + threshold):
+                regressions.append((name, metric, old, new))
+    return regressions
+
+def compare_benchmarks(baseline_path, current_path, threshold=REGRESSION_THRESHOLD):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    if baseline["scale"] != current["scale"] or baseline["device"] != current["device"]:
+        print("Warning: the benchmarks were run at different scales or on different devices.")
+    print(f"{'stage':<16}{'wall (s)':>22}{'peak RSS (MB)':>26}")
+    for name, stage in current["stages"].items():
+        old_stage = baseline["stages"].get(name, {})
+        if "error" in stage or "error" in old_stage or not old_stage:
+            print(f"{name:<16}{'n/a':>22}{'n/a':>26}")
+            continue
+        print(
+            f"{name:<16}{old_stage['wall_s']:>9.2f} -> {stage['wall_s']:<9.2f}"
+            f"{old_stage['peak_rss_mb']:>12.0f} -> {stage['peak_rss_mb']:<10.0f}"
+        )
+    regressions = find_regressions(baseline, current, threshold)
+    for name, metric, old, new in regressions:
+        print(f"Regression: {name} {metric} {old:.2f} -> {new:.2f} (+{100 * (new / old - 1):.0f}%)")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data with a stand-in model.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="benchmark the stages and save the results as JSON")
+    run_parser.add_argument("--scale", choices=list(BENCHMARK_SCALES), default="small")
+    run_parser.add_argument("--timesteps", type=int, help="override the scale's number of timesteps")
+    run_parser.add_argument("--members", type=int, help="override the scale's number of members")
+    run_parser.add_argument("--channels", nargs="+", help="override the scale's plotted channels")
+    run_parser.add_argument("--stages", nargs="+", choices=BENCHMARK_STAGES, default=BENCHMARK_STAGES)
+    run_parser.add_argument("--repeat", type=int, default=1, help="run every stage this many times, keep the fastest")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--workdir", default=BENCHMARK_DIR)
+    run_parser.add_argument("--keep", action="store_true", help="keep the synthetic data and outputs in workdir")
+    compare_parser = subparsers.add_parser("compare", help="compare two result files, exit code 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    stage_parser = subparsers.add_parser("stage", help="(internal) run and measure a single stage")
+    stage_parser.add_argument("name", choices=BENCHMARK_STAGES)
+    stage_parser.add_argument("--members", type=int, required=True)
+    stage_parser.add_argument("--channels", nargs="+", required=True)
+    stage_parser.add_argument("--result", required=True)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        scale = dict(BENCHMARK_SCALES[args.scale], name=args.scale)
+        for key in ["timesteps", "members", "channels"]:
+            if getattr(args, key) is not None:
+                scale[key] = getattr(args, key)
+        run_benchmark(scale, args.stages, args.repeat, args.output, os.path.abspath(args.workdir), args.keep)
+    elif args.command == "compare":
+        sys.exit(1 if compare_benchmarks(args.baseline, args.current, args.threshold) else 0)
+    else:
+        measure_stage(args.name, args.members, args.channels, args.result)
@@ -0,0 +1,66 @@
+import numpy as np
+
+# What part of each step a rollout output keeps. NetCDFSink cuts it out while the step is still on the device, so only
+# the captured part is copied to the host and written (see sink_pipeline.py).
+#   channels: names of the channels to keep (None: all)
+#   window: (y_min, y_max, x_min, x_max) box of grid indices to keep (None: the whole grid), grown by halo grid points on
+#     every side and clipped to the grid
+#   stride: keep every stride-th row and column
+#   lead_times: steps to keep (None: all)
+# A file captured over a window or with a stride records where its grid starts in the global grid, and its stride, as
+# the y_offset, x_offset and stride attributes of its forecast variable. limit_data reads them, so local windows are cut
+# out of such a file with the same global indices as out of a full one.
+# A file captured at some lead times records them in its lead_times attribute. The error and tracking readers pair
+# forecast and truth steps by position, so they refuse files whose lead times aren't the leading steps 0, 1, 2, ...
+class CaptureSpec:
+    def __init__(self, channels=None, window=None, halo=0, stride=1, lead_times=None):
+        self.channels = None if channels is None else list(channels)
+        self.window = None if window is None else tuple(int(bound) for bound in window)
+        self.halo = halo
+        self.stride = stride
+        self.lead_times = None if lead_times is None else sorted(set(lead_times))
+
+    # every channel of every step on the whole grid
+    def is_full(self):
+        return self.channels is None and self.window is None and self.stride == 1 and self.lead_times is None
+
+    def captures(self, step):
+        return self.lead_times is None or step in self.lead_times
+
+    # indices of the captured channels among channel_names, or None for all of them
+    def channel_indices(self, channel_names):
+        if self.channels is None:
+            return None
+        return [list(channel_names).index(channel) for channel in self.channels]
+
+    # captured rows and columns of a (num_lat, num_lon) grid, as slices
+    def grid_slices(self, num_lat, num_lon):
+        if self.window is None:
+            return slice(0, num_lat, self.stride), slice(0, num_lon, self.stride)
+        y_min, y_max, x_min, x_max = self.window
+        return (
+            slice(max(y_min - self.halo, 0), min(y_max + self.halo, num_lat), self.stride),
+            slice(max(x_min - self.halo, 0), min(x_max + self.halo, num_lon), self.stride),
+        )
+
+    # attributes a captured file needs to be read like a full one (none if it's on the whole grid at every step)
+    def file_attrs(self, num_lat, num_lon):
+        attrs = {}
+        if self.window is not None or self.stride != 1:
+            rows, cols = self.grid_slices(num_lat, num_lon)
+            attrs.update(y_offset=rows.start, x_offset=cols.start, stride=self.stride)
+        if self.lead_times is not None:
+            attrs["lead_times"] = self.lead_times
+        return attrs
+
+    # settings as plain values, for cache keys
+    def describe(self):
+        return {
+            "channels": self.channels, "window": None if self.window is None else list(self.window),
+            "halo": self.halo if self.window is not None else 0, "stride": self.stride, "lead_times": self.lead_times,
+        }
+
+# (lat, lon) coordinates of the captured grid
+def captured_grid(capture, lat, lon):
+    rows, cols = capture.grid_slices(len(lat), len(lon))
+    return np.asarray(lat)[rows], np.asarray(lon)[cols]
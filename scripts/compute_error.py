@@ -1,43 +1,57 @@
+import json
 import numpy as np
 import xarray as xr
-from geopy.distance import geodesic
+from geodesic_distance import geodesic_km, track_errors
 from load_data import *
 from track_hurricane import *
+from ic_store import open_ic_store, get_store_channel_index, source_fingerprint
+from ensemble_store import is_zarr_store, member_fingerprint
+from netcdf_writer import ForecastNetCDFWriter
+from tracing import traced
 from config import *
 
-# find dist between true and pred at each timestep (non-cumulative)
+# find dist between true and pred at each timestep (non-cumulative).
+# pred may be (time,) for one member or (members, time) for many, the true track is (time,)
 def compute_per_timestep_error(true_lats, true_lons, pred_lats, pred_lons):
-    return [
-        geodesic((true_lat, true_lon), (pred_lat, pred_lon)).km
-        for true_lat, true_lon, pred_lat, pred_lon in zip(true_lats, true_lons, pred_lats, pred_lons)
-    ]
+    return geodesic_km(true_lats, true_lons, pred_lats, pred_lons)
 
-# find cumulative error between true and pred at each timestep
+# find cumulative error between true and pred at each timestep (along the last axis)
 def compute_cumulative_error(true_lats, true_lons, pred_lats, pred_lons):
-    return np.cumsum(compute_per_timestep_error(true_lats, true_lons, pred_lats, pred_lons))
+    return track_errors(true_lats, true_lons, pred_lats, pred_lons)[1]
 
-# update error_log
-def update_error_log(error_log, noise_pct, seed, true_datapath, pred_datapath, timesteps):
-    ds_true = load_dataset(true_datapath)
-    ds_pred = load_dataset(pred_datapath)
-    
-    pred_msl_data = get_channel_data(ds_pred, 'msl')
-    msl_pred_limited = limit_data(pred_msl_data, timesteps, x_min, x_max, y_min, y_max)
-    true_msl_data = get_channel_data(ds_true, 'msl')
-    msl_true_limited = limit_data(true_msl_data, timesteps, x_min, x_max, y_min, y_max)
+# load the true msl values in the local window
+def load_true_msl_limited(true_datapath, timesteps):
+    store = open_ic_store(true_datapath)
+    msl_idx = get_store_channel_index('msl', true_datapath)
+    return np.array(store[:timesteps, msl_idx, y_min:y_max, x_min:x_max])
 
-    track_true_x, track_true_y, track_pred_x, track_pred_y = track_true_and_pred_locs(msl_true_limited, msl_pred_limited)
+# update error_log from msl values already limited to the local window
+def update_error_log_from_msl(error_log, noise_pct, seed, msl_true_limited, msl_pred_limited):
+    true_lats, true_lons, _ = track_storm(msl_true_limited, y_min, x_min)
+    pred_lats, pred_lons, _ = track_storm(msl_pred_limited, y_min, x_min)
+    record_member_errors(error_log, noise_pct, seed, compute_cumulative_error(true_lats, true_lons, pred_lats, pred_lons))
 
-    # convert indices of min msl positions to lat and lon
-    track_true_y = index_to_lat_vec(np.array(track_true_y) + y_min)
-    track_true_x = index_to_lon_vec(np.array(track_true_x) + x_min)
-    track_pred_y = index_to_lat_vec(np.array(track_pred_y) + y_min)
-    track_pred_x = index_to_lon_vec(np.array(track_pred_x) + x_min)
-    
+# add a member's cumulative errors to error_log (first result for a seed wins)
+def record_member_errors(error_log, noise_pct, seed, cumulative_errors):
     if noise_pct not in error_log:
         error_log[noise_pct] = {}
     if seed not in error_log[noise_pct]:
-        error_log[noise_pct][seed] = compute_cumulative_error(track_true_y, track_true_x, track_pred_y, track_pred_x).tolist()
+        error_log[noise_pct][seed] = np.asarray(cumulative_errors).tolist()
+
+# lat and lon of min msl in the true data at each timestep
+@traced
+def compute_true_track(true_datapath, timesteps):
+    true_lats, true_lons, _ = track_storm(load_true_msl_limited(true_datapath, timesteps), y_min, x_min)
+    return true_lats, true_lons
+
+# update error_log
+@traced
+def update_error_log(error_log, noise_pct, seed, true_datapath, pred_datapath, timesteps):
+    ds_pred = load_dataset(pred_datapath)
+    pred_msl_data = get_channel_data(ds_pred, 'msl')
+    msl_pred_limited = limit_data(pred_msl_data, timesteps, x_min, x_max, y_min, y_max)
+    msl_true_limited = load_true_msl_limited(true_datapath, timesteps)
+    update_error_log_from_msl(error_log, noise_pct, seed, msl_true_limited, msl_pred_limited)
 
 # given noise level, calculates mean and std over all seeds per timestep (for hurricane trajectory cumulative distance error)
 def compute_error_distribution(error_log, noise_pct):
@@ -47,20 +61,51 @@ def compute_error_distribution(error_log, noise_pct):
     timesteps = np.arange(len(mean_error))
     return timesteps, mean_error, std_error
 
+# the truth file names its grid latitude/longitude while forecasts use lat/lon
+def rename_grid_dims(ds):
+    return ds.rename({name: short for name, short in [("latitude", "lat"), ("longitude", "lon")] if name in ds.dims})
+
+# what a dataset was read from (file as it is now, or ensemble member as it is now), so cached results can be checked
+def dataset_fingerprint(data):
+    if not isinstance(data, xr.Dataset):
+        return source_fingerprint(data)
+    source = data.encoding["source"]
+    if is_zarr_store(source):
+        return member_fingerprint(source, float(data['noise'].values), int(data['member'].values))
+    selection = {name: str(coord.values) for name, coord in data.coords.items() if coord.ndim == 0}
+    return {"source": source_fingerprint(source), "selection": selection}
+
+# pred - truth as a lazy, chunked dataset laid out like the forecast files (time, channel, lat, lon).
+# nothing is read until values are requested, and then only the (timestep, channel) chunks that are needed, so it can be
+# handed straight to visualize_global and the plot_errors functions. pass stats_path to cache its error statistics there
+def open_error_view(true_datapath, pred_datapath, timesteps=None, stats_path=None):
+    ds_pred = rename_grid_dims(load_dataset(pred_datapath))
+    ds_true = rename_grid_dims(load_dataset(true_datapath))
+    check_leading_steps(ds_pred['forecast'])
+    pred = ds_pred['forecast'].isel(time=slice(None, timesteps)).chunk(ERROR_CHUNKS)
+    true = ds_true['forecast'].sel(channel=ds_pred.channel.values)  # pred may hold a subset of channels
+    true = true.isel(time=slice(None, pred.sizes['time'])).chunk(ERROR_CHUNKS)
+
+    # timesteps are matched by position, so use the forecast's coords for both
+    error = pred.copy(data=pred.data - true.data)
+    error_ds = error.to_dataset(name="forecast")
+    error_ds.attrs["stats_key"] = json.dumps({
+        "true": dataset_fingerprint(true_datapath), "pred": dataset_fingerprint(pred_datapath), "timesteps": timesteps
+    }, sort_keys=True)
+    if stats_path is not None:
+        error_ds.attrs["stats_path"] = stats_path
+    return error_ds
+
+# write an error view to NetCDF one (timestep, channel) chunk at a time
+def write_error_dataset(error_datapath, error_ds):
+    error = error_ds['forecast']
+    with ForecastNetCDFWriter(error_datapath, error.channel.values, error.lat.values, error.lon.values) as writer:
+        for t in range(error.sizes['time']):
+            writer.set_time(t, error.time.values[t])
+            for channel_idx in range(error.sizes['channel']):
+                writer.write_channel(t, channel_idx, error[t, channel_idx].values)
+
 # creates netcdf file of pred - true error globally
+@traced
 def generate_global_error_dataset(error_datapath, true_datapath, pred_datapath, timesteps=15):
-    ds_true = load_dataset(true_datapath)
-    true_vals = ds_true['forecast'].values[:timesteps]
-    ds_pred = load_dataset(pred_datapath)
-    pred_vals = ds_pred['forecast'].values[:timesteps]
-    error_vals = pred_vals - true_vals
-    dims = ['time', 'channel', 'lat', 'lon']
-    error_xr = xr.DataArray(
-        error_vals,
-        dims = dims,
-        coords = {k: ds_pred.coords[k] for k in dims},
-        name = "forecast"
-    )
-    error_ds = error_xr.to_dataset()
-    error_ds.to_netcdf(error_datapath)
-    error_ds.close()
+    write_error_dataset(error_datapath, open_error_view(true_datapath, pred_datapath, timesteps))
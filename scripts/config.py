@@ -12,16 +12,46 @@ PLOT_ERROR_GLOBAL = True
 CLEAN_UP = False
 
 # TODO: choose number of timesteps, directories, channels to visualize
-TIMESTEPS = 15                  # number of timesteps to run
-HOME_PATH = "/your/path/here"   # home directory to contain data and plots
-MODEL_DIR = "/your/path/here"   # directory which contains model information: weights.tar, global_means.npy, global_stds.npy, metadata.json
-ERA5_STATS_DIR = "/your/path/here"  # directory which contains the original global_means.npy and global_stds.npy
+# (the FCNV2_* environment variables override these, e.g. to point benchmark.py's stages at synthetic data)
+TIMESTEPS = int(os.environ.get("FCNV2_TIMESTEPS", 15))                 # number of timesteps to run
+HOME_PATH = os.environ.get("FCNV2_HOME_PATH", "/your/path/here")   # home directory to contain data and plots
+MODEL_DIR = os.environ.get("FCNV2_MODEL_DIR", "/your/path/here")   # directory which contains model information: weights.tar, global_means.npy, global_stds.npy, metadata.json
+ERA5_STATS_DIR = os.environ.get("FCNV2_ERA5_STATS_DIR", "/your/path/here")  # directory which contains the original global_means.npy and global_stds.npy
 CHANNELS = ["msl", "u10m", "v10m"]  # list of channels which you want to visualize
+CACHE_FORECASTS = True          # reuse the outputs of forecasts already run with the same parameters, model, and input
+FORECAST_CACHE_QUOTA_GB = 200   # least recently used cached forecasts are evicted beyond this size
 
 # NOISE MODE ONLY
 # TODO: choose which noise levels to test, how many experiments per noise level, and how many timesteps
 NOISE_PCTS = [0.0, 0.02, 0.05, 0.10, 0.20, 0.35, 0.50]  # list of noise percents to test
 NUM_EXPERIMENTS = 30    # number of trials to run per noise percent
+PERTURBATION = "noise"  # "noise": independent gaussian noise per pixel; "correlated": spatially correlated noise (below)
+CORRELATION_LENGTH_KM = 250     # length scale of "correlated" perturbations (correlation exp(-r^2 / (2 L^2)) at distance r)
+SPECTRAL_BATCH = 8      # member-channel fields per batched FFT when making correlated perturbations
+NOISE_RNG = "philox"    # "philox": counter-based noise made on the device per (seed, channel); "torch": the original torch.randn noise
+BATCH_MEMBERS = True    # roll out several seeds per forward pass instead of one at a time
+MAX_BATCH_SIZE = 8      # upper bound on members per forward pass (actual size is picked from free memory)
+ASYNC_SINKS = True      # copy each step to the host and run the sinks (tracking, writing) on a writer thread while the next step computes
+SINK_QUEUE_STEPS = 2    # steps the writer may fall behind before the rollout waits for it (see sink_pipeline.py)
+MEMBER_MEMORY_FACTOR = 12   # rough memory needed per member, in multiples of one initial condition tensor
+SAVE_FULL_FIELDS = False    # also write every member's full forecast to ENSEMBLE_STORE_PATH (tracking never needs it)
+RETAIN_MEMBERS = True   # keep best/median/worst member outputs on disk while the sweep runs, so local plots never re-run inference
+RETAIN_K = 1            # keep the k best and k worst members at each noise level (plus any member that may end up median)
+RESUME = True           # continue an interrupted sweep from LEDGER_PATH (skipping finished members) instead of starting over
+SWEEP_SEED = 0          # fixes the shuffle of seeds across members, so every process and node runs the same experiments
+SWEEP_PROCESSES = 1     # >1 splits the sweep across that many local processes, one GPU each (see sweep_runner.py)
+QUEUE_UNIT_SIZE = 8     # members per work unit when nodes pull work from the shared queue
+QUEUE_STALE_HOURS = 6   # a claimed unit not finished after this long is assumed abandoned and handed to another worker
+
+# TODO: choose how plots are rendered
+PARALLEL_RENDER = True      # render frames, animations, and error plots on a pool of worker processes
+RENDER_WORKERS = os.cpu_count()     # number of render worker processes
+RENDER_WORKER_MEMORY_GB = 8     # address space limit of each render worker
+RENDER_TASKS_PER_WORKER = 20    # restart each worker after this many jobs to release leaked figures
+SAVE_FRAMES = False     # also save every animation frame as a PNG (in a frames/ folder next to the animation)
+
+# TODO: choose whether to trace the pipeline stages
+TRACE_PATH = os.environ.get("FCNV2_TRACE_PATH")    # write a Chrome trace of the pipeline stages here (None: tracing off), see tracing.py
 
 # set limits on area (lats/lons) of local data
 # for latitude, degrees north is positive and south is negative
@@ -38,6 +68,17 @@ DISTRIBUTIONS = ["normal", "chi-sq", "lognormal", "uniform"]
 
 # =================================================================================================
 
+# pressure levels (hPa) of the FCNv2 pressure-level channels
+PRESSURE_LEVELS = [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000]
+
+# channels saved for retained members: everything the visualizations and the layered wind export read
+RETAIN_CHANNELS = list(dict.fromkeys(
+    ["msl", "u10m", "v10m"] + CHANNELS + [f"{var}{lev}" for var in ["u", "v"] for lev in PRESSURE_LEVELS]
+))
+RETAIN_WINDOW = True    # retained members keep only the local window; global and error plots re-run the few members they show
+RETAIN_HALO = 8         # grid points kept around the local window by RETAIN_WINDOW
+FULL_CAPTURE_MEMBERS = []   # member indices (at every noise level) retained with all channels on the global grid, whatever the above
+
 # convert lat/lon to indices to use later
 x_min = lon_to_index(WESTMOST_LON)
 x_max = lon_to_index(EASTMOST_LON)
@@ -45,14 +86,30 @@ y_min = lat_to_index(NORTHMOST_LAT)
 y_max = lat_to_index(SOUTHMOST_LAT)
 
 # predetermine random list of seeds for 
-SEEDS = randomize_seeds(len(NOISE_PCTS) * NUM_EXPERIMENTS)
+SEEDS = randomize_seeds(len(NOISE_PCTS) * NUM_EXPERIMENTS, SWEEP_SEED)
 
 # set up folder architecture
 DATA_PATH = os.path.join(HOME_PATH, "data")
 PRED_PATH = os.path.join(DATA_PATH, "hurricane_run.nc")
 TRUE_PATH = os.path.join(DATA_PATH, "fcnv2_input.nc")
+IC_STORE_DIR = os.path.join(DATA_PATH, "fcnv2_input_store")   # memory-mapped copy of TRUE_PATH, built on first use
 ERROR_LOG_PATH = os.path.join(DATA_PATH, "error_log.json")
+LEDGER_PATH = os.path.join(DATA_PATH, "sweep_ledger.jsonl")   # append-only record of every finished member
+SHARD_DIR = os.path.join(DATA_PATH, "shards")   # per-worker ledgers and retention indices of a sharded sweep
+QUEUE_DIR = os.path.join(SHARD_DIR, "queue")    # claim/done markers of the shared work queue
 ERROR_DATAPATH = os.path.join(DATA_PATH, "error_ds.nc")
+ERROR_DIR = os.path.join(DATA_PATH, "errors")  # cached error statistics of each visualized member
+ERROR_CHUNKS = {"time": 1, "channel": 1}    # chunks of the lazy pred - truth error views
+REGENERATED_DIR = os.path.join(DATA_PATH, "regenerated")  # forecasts re-run for plotting when no saved copy exists
+ENSEMBLE_STORE_PATH = os.path.join(DATA_PATH, "ensemble.zarr")  # chunked (noise, member, time, channel, lat, lon) store
+ENSEMBLE_CHUNK_LAT = 181    # chunk size of the ensemble store along lat
+ENSEMBLE_CHUNK_LON = 360    # chunk size of the ensemble store along lon
+FORECAST_CACHE_DIR = os.path.join(DATA_PATH, "forecast_cache")  # outputs of finished forecasts, by hash of their spec and inputs
+LAYERED_DATA_PATH = os.path.join(DATA_PATH, "layered_data.nc")  # u, v, wind speed on all levels of selected members
+LAYERED_JSON_PATH = os.path.join(DATA_PATH, "layered_data.json")  # the same data in the nested JSON layout
+BENCHMARK_DIR = os.path.join(HOME_PATH, "benchmark")  # synthetic data and outputs of benchmark.py runs
+RETAINED_DIR = os.path.join(DATA_PATH, "retained")
+RETAINED_INDEX_PATH = os.path.join(RETAINED_DIR, "index.json")
 
 PLOT_DIR = os.path.join(HOME_PATH, "plots")
 PRED_PLOT_DIR = os.path.join(PLOT_DIR, "predictions")
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import xarray as xr
+import zarr
+from zarr.codecs import BloscCodec
+from config import ENSEMBLE_STORE_PATH, ENSEMBLE_CHUNK_LAT, ENSEMBLE_CHUNK_LON
+
+# Chunked, compressed Zarr store for a whole noise sweep, dims (noise, member, time, channel, lat, lon).
+# A chunk holds one (lat, lon) tile of one channel at one timestep of one member, so reading a single channel
+# or a regional window only decompresses the tiles it touches, and members never share a chunk, so any number of
+# processes can write different members at the same time.
+# The store is laid out so xarray reads it as a regular dataset (see load_data.load_dataset).
+
+FORECAST_DIMS = ["noise", "member", "time", "channel", "lat", "lon"]
+
+def is_zarr_store(path):
+    return isinstance(path, (str, os.PathLike)) and os.path.exists(os.path.join(path, "zarr.json"))
+
+def _create_coord(group, name, values, dims, dtype=None, attrs=None):
+    values = np.asarray(values, dtype=dtype)
+    # strings are stored as zarr's variable-length "str" type, which has a stable v3 spec
+    array = group.create_array(name, shape=values.shape, dtype="str" if dtype is str else values.dtype, dimension_names=dims)
+    array[:] = values
+    if attrs:
+        array.attrs.update(attrs)
+
+# create the (empty) store for the sweep. safe to call from several processes: an existing store is left as is
+def create_ensemble_store(store_path, noise_pcts, num_members, times, channel_names, lat, lon):
+    if is_zarr_store(store_path):
+        return
+    # build under a temporary name and rename into place, so other processes never open a half-created store
+    tmp_path = store_path + f".{os.getpid()}.tmp"
+    group = zarr.open_group(tmp_path, mode="w")
+
+    time_units = f"hours since {times[0]:%Y-%m-%d %H:%M:%S}"
+    hours = [(t - times[0]).total_seconds() / 3600. for t in times]
+    _create_coord(group, "noise", noise_pcts, ["noise"], dtype=np.float64)
+    _create_coord(group, "member", np.arange(num_members), ["member"], dtype=np.int64)
+    _create_coord(group, "time", hours, ["time"], dtype=np.float64, attrs={"units": time_units, "calendar": "proleptic_gregorian"})
+    _create_coord(group, "channel", list(channel_names), ["channel"], dtype=str)
+    _create_coord(group, "lat", lat, ["lat"], dtype=np.float64)
+    _create_coord(group, "lon", lon, ["lon"], dtype=np.float64)
+
+    # seed of each member, written last so -1 means "not (fully) written yet"
+    group.create_array(
+        "seed", shape=(len(noise_pcts), num_members), chunks=(1, 1), dtype=np.int64, fill_value=-1,
+        dimension_names=["noise", "member"]
+    )
+
+    shape = (len(noise_pcts), num_members, len(times), len(channel_names), len(lat), len(lon))
+    group.create_array(
+        "forecast", shape=shape, chunks=(1, 1, 1, 1, ENSEMBLE_CHUNK_LAT, ENSEMBLE_CHUNK_LON), dtype=np.float32,
+        compressors=BloscCodec(cname="lz4", clevel=5, shuffle="bitshuffle"), fill_value=np.nan,
+        dimension_names=FORECAST_DIMS
+    )
+
+    try:
+        os.rename(tmp_path, store_path)
+    except OSError:  # another process created the store first
+        shutil.rmtree(tmp_path)
+
+# open the whole store lazily (nothing is read until values are requested)
+def open_ensemble_store(store_path=ENSEMBLE_STORE_PATH):
+    return xr.open_zarr(store_path, chunks=None, consolidated=False)
+
+# index of the member written with a given seed at a given noise level, or None if it isn't in the store
+def find_member(ds, noise_pct, seed):
+    seeds = ds['seed'].sel(noise=noise_pct).values
+    matches = np.where(seeds == seed)[0]
+    return int(matches[0]) if len(matches) else None
+
+# one member as a (time, channel, lat, lon) dataset, still lazy. works with everything in load_data
+def load_member(noise_pct, seed, store_path=ENSEMBLE_STORE_PATH):
+    if not is_zarr_store(store_path):
+        return None
+    ds = open_ensemble_store(store_path)
+    member_idx = find_member(ds, noise_pct, seed)
+    if member_idx is None:
+        return None
+    return ds.sel(noise=noise_pct).isel(member=member_idx)
+
+# what one member of the store holds as it is now: its seed plus the size and mtime of each of its forecast chunk files.
+# chunks are rewritten in place under forecast/c/<noise>/<member>/..., which leaves the store directory itself unchanged
+def member_fingerprint(store_path, noise_pct, member_idx):
+    ds = open_ensemble_store(store_path)
+    noise_idx = int(np.where(ds['noise'].values == noise_pct)[0][0])
+    chunk_dir = os.path.join(store_path, "forecast", "c", str(noise_idx), str(member_idx))
+    chunks = []
+    for root, dirs, files in os.walk(chunk_dir):
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            chunks.append((os.path.relpath(os.path.join(root, name), chunk_dir), stat.st_size, stat.st_mtime_ns))
+    return {
+        "path": os.path.abspath(store_path), "seed": int(ds['seed'].values[noise_idx, member_idx]),
+        "chunks": hashlib.sha256(json.dumps(sorted(chunks)).encode()).hexdigest(),
+    }
+
+# write one member into the store step by step
+class ZarrMemberSink:
+    def __init__(self, store_path, noise_idx, member_idx, seed):
+        group = zarr.open_group(store_path, mode="r+")
+        self.forecast = group["forecast"]
+        self.seeds = group["seed"]
+        self.noise_idx = noise_idx
+        self.member_idx = member_idx
+        self.seed = seed
+
+    def consume(self, step, time, output):
+        self.forecast[self.noise_idx, self.member_idx, step] = output.cpu().numpy()
+
+    def finalize(self):
+        self.seeds[self.noise_idx, self.member_idx] = self.seed
@@ -0,0 +1,114 @@
+import os
+import json
+import numpy as np
+import xarray as xr
+from load_data import load_dataset, get_channel_data
+from ic_store import source_fingerprint
+from tracing import traced
+from config import x_min, x_max, y_min, y_max
+
+# Per-timestep statistics of an error dataset (quantiles, moments, min/max, fixed-bin histograms), for the whole
+# globe and the local window. Each channel is read once and all of its timesteps are reduced together; the results
+# are cached in a small .npz next to the dataset so every error plot just reads the precomputed numbers.
+# Lazy error views (compute_error.open_error_view) work too: they're cached at their stats_path, if they have one.
+
+STATS_PERCENTILES = [0, 5, 25, 50, 75, 95, 100]  # 0 and 100 are the min and max
+HIST_BINS = 100
+REGIONS = ["global", "local"]
+
+def stats_cache_path(error_datapath):
+    if isinstance(error_datapath, xr.Dataset):
+        return error_datapath.attrs.get("stats_path")
+    return str(error_datapath) + ".stats.npz"
+
+# the cache is only valid for the dataset as it is now, and for the same local window / percentiles / bins
+def stats_cache_key(error_datapath):
+    if isinstance(error_datapath, xr.Dataset):
+        source = error_datapath.attrs["stats_key"]
+    else:
+        source = source_fingerprint(error_datapath)
+    return json.dumps({
+        "source": source,
+        "window": [x_min, x_max, y_min, y_max],
+        "percentiles": STATS_PERCENTILES,
+        "bins": HIST_BINS,
+    }, sort_keys=True)
+
+# reduce (time, pixels) errors to per-timestep statistics
+def _reduce(errors, hist_range):
+    mean = errors.mean(axis=1, dtype=np.float64)
+    centered = errors - mean[:, None]
+    m2 = np.mean(centered ** 2, axis=1)
+    m3 = np.mean(centered ** 3, axis=1)
+    m4 = np.mean(centered ** 4, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        skewness = m3 / m2 ** 1.5       # same (biased) estimators as scipy.stats skew and kurtosis
+        kurt = m4 / m2 ** 2 - 3
+
+    # fixed-bin histograms of every timestep in one bincount (values outside the range are dropped, like np.histogram)
+    lo, hi = hist_range
+    width = (hi - lo) / HIST_BINS if hi > lo else 1.
+    bin_idx = np.floor((errors - lo) / width).astype(np.int64)
+    bin_idx[errors == hi] = HIST_BINS - 1
+    in_range = (bin_idx >= 0) & (bin_idx < HIST_BINS)
+    offsets = np.arange(errors.shape[0])[:, None] * HIST_BINS
+    counts = np.bincount((bin_idx + offsets)[in_range], minlength=errors.shape[0] * HIST_BINS)
+
+    return {
+        "percentiles": np.percentile(errors, STATS_PERCENTILES, axis=1).T,     # (time, percentile)
+        "mean": mean,
+        "std": np.sqrt(m2),
+        "skew": skewness,
+        "kurtosis": kurt,
+        "hist_counts": counts.reshape(errors.shape[0], HIST_BINS),
+        "hist_edges": np.linspace(lo, hi, HIST_BINS + 1),
+    }
+
+# statistics of each channel over all timesteps, as {f"{region}/{channel}/{stat}": array}
+@traced
+def compute_error_stats(error_datapath, channels):
+    ds = load_dataset(error_datapath)
+    stats = {}
+    for channel in channels:
+        data = get_channel_data(ds, channel).values     # (time, lat, lon), read once
+        # histogram range (both regions): 99th percentile of the global error magnitude at the first and last timestep
+        max_abs = max(np.percentile(np.abs(data[0]), 99), np.percentile(np.abs(data[-1]), 99))
+        for region in REGIONS:
+            errors = data if region == "global" else data[:, y_min:y_max, x_min:x_max]
+            errors = errors.reshape(errors.shape[0], -1)
+            for name, values in _reduce(errors, (-max_abs, max_abs)).items():
+                stats[f"{region}/{channel}/{name}"] = values
+    return stats
+
+# cached statistics for the given channels, computed (and saved next to the dataset) if the cache is missing or stale
+def load_error_stats(error_datapath, channels):
+    cache_path = stats_cache_path(error_datapath)
+    key = stats_cache_key(error_datapath)
+    stats = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if str(cached["key"]) == key:
+                    stats = {name: cached[name] for name in cached.files if name != "key"}
+        except (ValueError, KeyError, OSError):
+            pass
+
+    missing = [channel for channel in channels if f"global/{channel}/mean" not in stats]
+    if missing:
+        stats.update(compute_error_stats(error_datapath, missing))
+        if cache_path is None:
+            return stats
+        # write under a temporary name and rename, so render workers never read a partial file
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        tmp_path = cache_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, key=np.array(key), **stats)
+        os.replace(tmp_path, cache_path)
+    return stats
+
+# statistics of one channel in one region ('global' or 'local') as {stat: array}
+def get_channel_stats(error_datapath, channel, mode='global'):
+    region = "local" if mode.lower()[0] == 'l' else "global"
+    stats = load_error_stats(error_datapath, [channel])
+    prefix = f"{region}/{channel}/"
+    return {name[len(prefix):]: values for name, values in stats.items() if name.startswith(prefix)}
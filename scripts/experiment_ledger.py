@@ -0,0 +1,90 @@
+import os
+import json
+from compute_error import record_member_errors
+from config import LEDGER_PATH
+
+# Append-only ledger of finished noise-sweep members: one JSON line per member, written and fsynced as soon as its
+# errors are known, so an interrupted sweep only loses the members that were still running.
+# The first line describes the sweep (noise levels and seed of every member) so a resumed run repeats exactly the
+# same experiments, and skips the ones already in the ledger.
+
+def _append_line(path, record):
+    line = (json.dumps(record) + "\n").encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# (sweep description, member records) in the ledger at path. a last line cut short by a crash is ignored
+def read_ledger(path=LEDGER_PATH):
+    sweep, records = None, []
+    try:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return sweep, records
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "sweep" in record:
+            sweep = record["sweep"]
+        else:
+            records.append(record)
+    return sweep, records
+
+# error log (noise_pct -> seed -> cumulative errors) of every member in the ledger
+def load_ledger_error_log(path=LEDGER_PATH):
+    error_log = {}
+    for record in read_ledger(path)[1]:
+        record_member_errors(error_log, record["noise_pct"], record["seed"], record["errors"])
+    return error_log
+
+class ExperimentLedger:
+    # sweep: description of the sweep about to run (noise_sweep.sweep_description). with resume, an existing ledger for
+    # the same noise levels, member count, and kind of noise is continued (keeping its seeds), otherwise it starts over
+    def __init__(self, sweep, path=LEDGER_PATH, resume=True):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        existing, _ = read_ledger(path)
+        same_sweep = existing is not None and all(
+            existing.get(key) == sweep.get(key) for key in ["noise_pcts", "num_experiments", "noise_rng", "perturbation", "seeds"]
+        )
+        if resume and existing is not None and not same_sweep:
+            raise ValueError(f"{path} belongs to a different sweep; turn off RESUME or move it to start a new one.")
+
+        if resume and same_sweep:
+            self.sweep = existing
+            self._end_partial_line()
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            self.sweep = sweep
+            _append_line(path, {"sweep": sweep})
+        self.error_log = load_ledger_error_log(path)
+        # kept apart from error_log, which the sweep fills in itself before a member is recorded here
+        self.done = {(noise_pct, seed) for noise_pct, seed2error in self.error_log.items() for seed in seed2error}
+
+    # a crash mid-write can leave a line without its newline; make sure the next record starts on its own line
+    def _end_partial_line(self):
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def is_done(self, noise_pct, seed):
+        return (noise_pct, seed) in self.done
+
+    # append a finished member (first result for a seed wins, like record_member_errors)
+    def record(self, noise_pct, seed, cumulative_errors):
+        if self.is_done(noise_pct, seed):
+            return
+        errors = [float(error) for error in cumulative_errors]
+        _append_line(self.path, {"noise_pct": noise_pct, "seed": seed, "errors": errors})
+        self.done.add((noise_pct, seed))
+        record_member_errors(self.error_log, noise_pct, seed, errors)
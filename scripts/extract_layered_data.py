@@ -1,79 +1,137 @@
+import os
+import json
+import argparse
 import numpy as np
-from noisy_hurricane import run_inference
+import xarray as xr
+from generate_forecast import run_inference
+from member_retention import load_retention_index, get_retained_path
+from ensemble_store import load_member
 from load_data import *
 from config import *
 from track_hurricane import index_to_lat, index_to_lon
+from tracing import traced
 
-# Convert forecast data to JSON file with architecture:
-# noise level (%) -> variable (u, v, wind speed) -> pressure level (50-1000) -> timestep (0-14) -> lat -> lon -> raw data (km/hr)
+# Export u, v, and wind speed on every pressure level over the local window, for a few members and the ERA5 truth.
+# The export is one NetCDF file with variables u, v, wind_speed of shape (run, level, time, lat, lon) and explicit
+# run/noise/seed/level/time/lat/lon coordinates, written straight from the stacked arrays.
+# Tools that need the old nested JSON layout
+#   run (noise level or "real") -> variable (u, v, wind speed) -> pressure level -> timestep -> lat -> lon -> value (m/s)
+# can get it streamed from the NetCDF file, one time slice at a time.
+#   python extract_layered_data.py export [--json]     # write LAYERED_DATA_PATH (and LAYERED_JSON_PATH)
+#   python extract_layered_data.py json                # convert an existing export to LAYERED_JSON_PATH
 
-json_datapath = "hurricane_predictions/data/layered_data.json"
-layered_data = {}
+# (run label, noise level, which member of that level) of each exported run; the truth has no noise level
+LAYERED_RUNS = [("0.0", 0.0, "best"), ("0.05", 0.05, "best"), ("0.2", 0.2, "median"), ("0.5", 0.5, "worst"), ("real", None, "truth")]
+LAYERED_VARIABLES = [("u", "u"), ("v", "v"), ("wind_speed", "wind speed")]     # (NetCDF name, JSON name)
 
-def array_to_time_lat_lon_dict(arr):
-    """
-    Convert (time, lat, lon) NumPy array to nested dict:
-    time_index -> lat_value -> lon_value -> float
-    """
-    out = {}
-    timesteps, n_lat, n_lon = arr.shape
+# seed of the best, median, and worst member of a noise level
+def select_member(error_log, noise_pct, selection):
+    total_errors = sorted([(seed, errors[-1]) for seed, errors in error_log[noise_pct].items()], key = lambda x: x[1])
+    return {"best": total_errors[0][0], "median": total_errors[len(total_errors) // 2][0], "worst": total_errors[-1][0]}[selection]
 
-    for t in range(timesteps):
-        lat_dict = {}
-        for i_lat in range(n_lat):
-            lat_val = index_to_lat(i_lat + y_min)
-            lon_dict = {}
-            for i_lon in range(n_lon):
-                lon_val = index_to_lon(i_lon + x_min)
-                lon_dict[lon_val] = float(arr[t, i_lat, i_lon])
-            lat_dict[lat_val] = lon_dict
-        out[t] = lat_dict
+# forecast of a member: the copy kept by the sweep or saved in the ensemble store, re-run only if neither has it
+def member_dataset(noise_pct, seed, retention_index):
+    pred_path = get_retained_path(retention_index, noise_pct, seed)
+    if pred_path is None:
+        pred_path = load_member(noise_pct, seed)
+    if pred_path is None:
+        pred_path = os.path.join(REGENERATED_DIR, f"layered_noise{int(noise_pct*100):02d}_seed{seed}.nc")
+        run_inference(mode=PERTURBATION, noise_prop=noise_pct, seed=seed, verbose=False, output_path=pred_path)
+    return load_dataset(pred_path)
 
-    return out
+# u and v on every pressure level over the local window, each of shape (level, time, lat, lon)
+def load_layered_winds(ds, levels=PRESSURE_LEVELS):
+    channels = [f"u{level}" for level in levels] + [f"v{level}" for level in levels]
+    winds = limit_data(ds['forecast'].sel(channel=channels), TIMESTEPS, x_min, x_max, y_min, y_max)  # (time, channel, lat, lon)
+    winds = winds.reshape(winds.shape[0], 2, len(levels), *winds.shape[2:]).transpose(1, 2, 0, 3, 4)
+    return winds[0], winds[1]
 
-error_log = load_json(ERROR_LOG_PATH)
-best_seeds = {}
-median_seeds = {}
-worst_seeds = {}
-for noise_pct, seed2error in error_log.items():
-    total_errors = [(seed, errors[-1]) for seed, errors in seed2error.items()]
-    total_errors.sort(key = lambda x: x[1])
-    best_seeds[noise_pct] = total_errors[0][0]
-    median_seeds[noise_pct] = total_errors[len(total_errors) // 2][0]
-    worst_seeds[noise_pct] = total_errors[-1][0]
+# stacked (run, variable, level, time, lat, lon) data of all LAYERED_RUNS as a Dataset
+@traced
+def build_layered_dataset(error_log, levels=PRESSURE_LEVELS):
+    retention_index = load_retention_index()
+    stacked, seeds, times = [], [], None
+    for label, noise_pct, selection in LAYERED_RUNS:
+        if noise_pct is None:
+            ds, seed = load_dataset(TRUE_PATH), -1
+            times = ds.time.values[:TIMESTEPS]
+        else:
+            seed = select_member(error_log, noise_pct, selection)
+            ds = member_dataset(noise_pct, seed, retention_index)
+        u, v = load_layered_winds(ds, levels)
+        stacked.append(np.stack([u, v, np.sqrt(u**2. + v**2.)]))
+        seeds.append(seed)
+        ds.close()
+    stacked = np.stack(stacked).astype(np.float32)
 
-noise_levels = ['0.0', '0.05', '0.2', '0.5', 'real']
-for noise_pct in noise_levels:
-    if noise_pct not in layered_data:
-        layered_data[noise_pct] = {}
-        layered_data[noise_pct]['u'] = {}
-        layered_data[noise_pct]['v'] = {}
-        layered_data[noise_pct]['wind speed'] = {}
+    coords = {
+        "run": [label for label, _, _ in LAYERED_RUNS],
+        "noise": ("run", [np.nan if noise_pct is None else noise_pct for _, noise_pct, _ in LAYERED_RUNS]),
+        "selection": ("run", [selection for _, _, selection in LAYERED_RUNS]),
+        "seed": ("run", seeds),
+        "level": ("level", list(levels), {"units": "hPa"}),
+        "time": times,
+        "lat": index_to_lat(np.arange(y_min, y_max)),
+        "lon": index_to_lon(np.arange(x_min, x_max)),
+    }
+    dims = ["run", "level", "time", "lat", "lon"]
+    data_vars = {
+        name: (dims, stacked[:, var_idx], {"units": "m s**-1"}) for var_idx, (name, _) in enumerate(LAYERED_VARIABLES)
+    }
+    return xr.Dataset(data_vars, coords=coords)
 
-    if noise_pct != 'real':
-        if noise_pct in ['0.0', '0.05']:
-            seed = best_seeds[float(noise_pct)]
-        elif noise_pct == '0.2':
-            seed = median_seeds[float(noise_pct)]
-        else:
-            seed = worst_seeds[float(noise_pct)]
-        run_inference(MODEL_DIR, TRUE_PATH, PRED_PATH, ERA5_STATS_DIR, TIMESTEPS, float(noise_pct), seed, verbose=False)
-        ds = load_dataset(PRED_PATH)
-    else:
-        ds = load_dataset(TRUE_PATH)
-    
-    for pressure_level in ['50', '100', '150', '200', '250', '300', '400', '500', '600', '700', '850', '925', '1000']:
-        zonal_wind = limit_data(get_channel_data(ds, 'u'+pressure_level), TIMESTEPS, x_min, x_max, y_min, y_max)
-        meridional_wind = limit_data(get_channel_data(ds, 'v'+pressure_level), TIMESTEPS, x_min, x_max, y_min, y_max)
-        wind_speeds = np.sqrt(zonal_wind**2. + meridional_wind**2.)
+def write_layered_dataset(path, layered_ds):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + f".{os.getpid()}.tmp"
+    layered_ds.to_netcdf(tmp_path, encoding={name: {"zlib": True} for name, _ in LAYERED_VARIABLES})
+    os.replace(tmp_path, path)
 
-        layered_data[noise_pct]['u'][pressure_level] = array_to_time_lat_lon_dict(zonal_wind)
-        layered_data[noise_pct]['v'][pressure_level] = array_to_time_lat_lon_dict(meridional_wind)
-        layered_data[noise_pct]['wind speed'][pressure_level] = array_to_time_lat_lon_dict(wind_speeds)
-    ds.close()
+# write the nested JSON layout of a layered export without building it in memory: one time slice (lat -> lon -> value)
+# is converted and written at a time
+@traced
+def write_layered_json(json_path, layered_ds):
+    lat_keys = [json.dumps(str(float(lat))) for lat in layered_ds.lat.values]
+    lon_keys = [json.dumps(str(float(lon))) for lon in layered_ds.lon.values]
+    tmp_path = json_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("{")
+        for run_idx, run in enumerate(layered_ds.run.values):
+            f.write(("," if run_idx else "") + f"\n{json.dumps(str(run))}: {{")
+            for var_idx, (name, json_name) in enumerate(LAYERED_VARIABLES):
+                f.write(("," if var_idx else "") + f"\n{json.dumps(json_name)}: {{")
+                for level_idx, level in enumerate(layered_ds.level.values):
+                    f.write(("," if level_idx else "") + f"\n{json.dumps(str(level))}: {{")
+                    for t in range(layered_ds.sizes["time"]):
+                        values = layered_ds[name].isel(run=run_idx, level=level_idx, time=t).values.tolist()
+                        rows = ", ".join(
+                            f"{lat_key}: {{" + ", ".join(f"{lon_key}: {json.dumps(value)}" for lon_key, value in zip(lon_keys, row)) + "}"
+                            for lat_key, row in zip(lat_keys, values)
+                        )
+                        f.write(("," if t else "") + f"\n{json.dumps(str(t))}: {{{rows}}}")
+                    f.write("}")
+                f.write("}")
+            f.write("}")
+        f.write("\n}\n")
+    os.replace(tmp_path, json_path)
 
-update_json(json_datapath, layered_data)
-        
-        
-        
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export layered wind data of selected members and the ERA5 truth.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write the layered NetCDF export")
+    export_parser.add_argument("--output", default=LAYERED_DATA_PATH)
+    export_parser.add_argument("--json", action="store_true", help="also write the nested JSON layout")
+    json_parser = subparsers.add_parser("json", help="convert a layered NetCDF export to the nested JSON layout")
+    json_parser.add_argument("--input", default=LAYERED_DATA_PATH)
+    for subparser in [export_parser, json_parser]:
+        subparser.add_argument("--json-output", default=LAYERED_JSON_PATH)
+    args = parser.parse_args()
 
+    if args.command == "export":
+        layered_ds = build_layered_dataset(load_json(ERROR_LOG_PATH))
+        write_layered_dataset(args.output, layered_ds)
+        print(f"Saved layered data to {args.output}")
+    else:
+        layered_ds = xr.open_dataset(args.input)
+    if args.command == "json" or args.json:
+        write_layered_json(args.json_output, layered_ds)
+        print(f"Saved layered JSON to {args.json_output}")
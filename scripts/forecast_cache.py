@@ -0,0 +1,186 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from config import FORECAST_CACHE_DIR, FORECAST_CACHE_QUOTA_GB, MODEL_DIR, TRUE_PATH, ERA5_STATS_DIR, TIMESTEPS, NOISE_RNG
+from config import CORRELATION_LENGTH_KM
+
+# Content-addressed cache of forecast outputs.
+# A forecast is fully determined by its spec (mode, noise level or distribution parameters, seed, timesteps) and the
+# contents of the model directory and input files, so its outputs are stored under a hash of all of them: a full
+# forecast, or just the summaries the noise sweep needs (hurricane track, retained channels).
+# Specs that can't change the result are collapsed first (the seed of a noise-free member, parameters the chosen
+# distribution doesn't use), so e.g. all noise_pct=0.0 members share a single entry.
+# Each key is a directory of artifacts; directories are touched on use and the least recently used ones are evicted
+# once the cache grows past FORECAST_CACHE_QUOTA_GB.
+
+FORECAST_ARTIFACT = "forecast.nc"
+FINGERPRINTS_FILE = "fingerprints.json"
+
+# sha1 of a file's contents. hashing model weights takes a while, so hashes are remembered (in the cache dir) for as long
+# as the file's size and modification time don't change
+def file_fingerprint(path, cache_dir=FORECAST_CACHE_DIR):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    memo_path = os.path.join(cache_dir, FINGERPRINTS_FILE)
+    try:
+        with open(memo_path, "r") as f:
+            memo = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        memo = {}
+    if path in memo and memo[path]["stamp"] == stamp:
+        return memo[path]["sha1"]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 23), b""):
+            digest.update(block)
+    memo[path] = {"stamp": stamp, "sha1": digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = memo_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(memo, f, indent=2)
+    os.replace(tmp_path, memo_path)
+    return memo[path]["sha1"]
+
+# fingerprint of every file in a directory (weights, normalization stats, metadata)
+def directory_fingerprint(directory):
+    digest = hashlib.sha1()
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            digest.update(f"{filename}:{file_fingerprint(path)}\n".encode())
+    return digest.hexdigest()
+
+# the parameters that determine a forecast, with the ones that can't affect it dropped (see get_noisy_input and
+# get_random_input in generate_forecast.py)
+def forecast_spec(
+    mode="noise", noise_prop=0.0, distribution="normal", mean=0, std=1, df=1, a=0, b=1, seed=42, timesteps=TIMESTEPS,
+    noise_rng=NOISE_RNG, correlation_length_km=CORRELATION_LENGTH_KM
+    ):
+    if mode.lower()[0] in "nc":
+        # noise is multiplied by noise_prop, so without noise every seed (and kind of noise) gives the same forecast
+        if noise_prop == 0:
+            return {"mode": "noise", "noise_prop": 0.0, "seed": None, "timesteps": timesteps}
+        if mode.lower()[0] == "c":  # correlated noise always comes from the counter-based generator
+            return {
+                "mode": "correlated", "noise_prop": float(noise_prop), "seed": int(seed),
+                "correlation_length_km": float(correlation_length_km), "timesteps": timesteps
+            }
+        return {"mode": "noise", "noise_prop": float(noise_prop), "seed": int(seed), "noise_rng": noise_rng, "timesteps": timesteps}
+    kind = distribution.lower()[0]
+    params = {
+        "n": {"distribution": "normal", "mean": mean, "std": std},
+        "c": {"distribution": "chi-sq", "df": df},
+        "u": {"distribution": "uniform", "a": a, "b": b},
+        "l": {"distribution": "lognormal", "mean": mean, "std": std},
+    }.get(kind, {"distribution": "default"})
+    params = {name: value if isinstance(value, str) else float(value) for name, value in params.items()}
+    return {"mode": "random", **params, "seed": int(seed), "timesteps": timesteps}
+
+# cache key of a spec for the current model and inputs. random-mode forecasts never read the input file, only the
+# model's own normalization stats (part of the model dir)
+def forecast_key(spec, model_dir=MODEL_DIR, input_path=TRUE_PATH, stats_dir=ERA5_STATS_DIR):
+    content = {"spec": spec, "model": directory_fingerprint(model_dir)}
+    if spec["mode"] != "random":
+        content["input"] = file_fingerprint(input_path)
+        content["noise_stds"] = file_fingerprint(os.path.join(stats_dir, "global_stds.npy"))
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+# make dst another name for src (a hard link, or a copy across file systems). both are written by replacing the file,
+# never in place, so neither can change the other
+def link_file(src, dst):
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    tmp_path = dst + f".{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def _entry_size(entry_dir):
+    size = 0
+    for filename in os.listdir(entry_dir):
+        try:
+            size += os.stat(os.path.join(entry_dir, filename)).st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+class ForecastCache:
+    def __init__(self, cache_dir=FORECAST_CACHE_DIR, quota_gb=FORECAST_CACHE_QUOTA_GB):
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_gb * 1024 ** 3
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    # path of a cached artifact (marking its entry as used), or None
+    def get(self, key, artifact):
+        path = os.path.join(self.entry_dir(key), artifact)
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(self.entry_dir(key))
+        except FileNotFoundError:   # evicted by another process in the meantime
+            return None
+        return path
+
+    # store the file at path as an artifact of key (path itself is left in place), then evict down to the quota
+    def put(self, key, artifact, path):
+        cached_path = os.path.join(self.entry_dir(key), artifact)
+        link_file(path, cached_path)
+        os.utime(self.entry_dir(key))
+        self.evict(keep=key)
+        return cached_path
+
+    # remove least recently used entries until the cache fits its quota (never the entry keep)
+    def evict(self, keep=None):
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                try:
+                    entries.append((os.stat(entry_dir).st_mtime_ns, key, entry_dir, _entry_size(entry_dir)))
+                except FileNotFoundError:
+                    pass
+        total = sum(entry[3] for entry in entries)
+        for _, key, entry_dir, size in sorted(entries):
+            if total <= self.quota_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+# artifact names of the noise sweep's per-member summaries; both depend on settings outside the forecast spec
+def track_artifact(y_min, y_max, x_min, x_max):
+    return f"track_y{y_min}-{y_max}_x{x_min}-{x_max}.npz"
+
+def retained_artifact(capture):
+    return f"retained_{hashlib.sha1(json.dumps(capture.describe(), sort_keys=True).encode()).hexdigest()[:12]}.nc"
+
+def save_track(cache, key, artifact, lats, lons, pressures):
+    tmp_path = os.path.join(cache.cache_dir, f"{key}.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, lats=np.asarray(lats), lons=np.asarray(lons), pressures=np.asarray(pressures))
+    cache.put(key, artifact, tmp_path)
+    os.remove(tmp_path)
+
+# (lats, lons, pressures) of a cached track, or None
+def load_track(cache, key, artifact):
+    path = cache.get(key, artifact)
+    if path is None:
+        return None
+    try:
+        with np.load(path) as track:
+            return track["lats"], track["lons"], track["pressures"]
+    except FileNotFoundError:   # evicted since
+        return None
@@ -1,29 +1,81 @@
 import torch
-import numpy as np
 from datetime import datetime
-from pathlib import Path
-import xarray as xr
 from tqdm import tqdm
 import os
 from torch.distributions import Chi2, LogNormal
-from earth2mip.networks import get_model
-from load_data import load_era5_stats, load_dataset, get_all_data_values
-from utils import set_seed, create_synthetic_stats, restore_channel_stats, calc_mean_and_std_from_distr, rescale_fcnv2_output
+from model_registry import get_cached_model
+from load_data import load_era5_stats, load_dataset
+from ic_store import get_initial_condition_view
+from perturbation import add_member_noise, add_correlated_noise
+from rollout_sinks import NetCDFSink
+from sink_pipeline import SinkPipeline
+from forecast_cache import ForecastCache, FORECAST_ARTIFACT, forecast_spec, forecast_key, link_file
+from utils import set_seed, calc_mean_and_std_from_distr, remap_normalization
+from tracing import traced, trace_span
 from config import *
 
-# add noise to real input
-def get_noisy_input(noise_prop: float):
+# load the real initial condition
+def get_initial_condition():
     size = (1, 1, 73, 721, 1440) # batch size, timesteps, channels, latitudes, longitudes
-    data = get_all_data_values(TRUE_PATH)
-    init_conds = data[0].reshape(size)
-    init_conds = torch.from_numpy(init_conds).float()
-    
+    init_conds = get_initial_condition_view(TRUE_PATH).reshape(size)  # memory-mapped, no read of the full file
+    return torch.from_numpy(init_conds).float()
+
+# era5 stds for each channel, shaped to broadcast against the initial condition
+def get_noise_stds():
     _, era5_stds = load_era5_stats()
-    stds = era5_stds[0, :, 0, 0].reshape(1, 1, 73, 1, 1)
+    return era5_stds[0, :, 0, 0].reshape(1, 1, 73, 1, 1)
+
+# add noise to real input
+@traced
+def get_noisy_input(noise_prop: float):
+    init_conds = get_initial_condition()
+    stds = get_noise_stds()
     base_noise = torch.randn_like(init_conds) # N(0,1)
     return init_conds + base_noise * noise_prop * stds # init_conds + N(0,noise_prop*stds)
 
+# add noise to real input for a batch of members, each drawn from its own seed.
+# member i gets exactly the noise get_noisy_input would produce after set_seed(seeds[i])
+@traced
+def get_noisy_input_batch(noise_prop: float, seeds):
+    init_conds = get_initial_condition()
+    stds = get_noise_stds()
+    batch = None
+    for i, seed in enumerate(seeds):
+        generator = torch.Generator().manual_seed(seed)
+        base_noise = torch.randn(init_conds.shape, generator=generator) # N(0,1)
+        member = init_conds + base_noise * noise_prop * stds
+        if batch is None:
+            batch = torch.empty((len(seeds),) + tuple(member.shape[1:]), dtype=member.dtype)
+        batch[i] = member[0]
+    return batch # shape: (members, timesteps, channels, lat, lon)
+
+# add noise to real input for a batch of members directly on device, in the input's dtype, with the counter-based
+# generator (perturbation.py): member i's noise depends only on seeds[i], never on global RNG state or batch layout.
+# with correlation_length_km, the noise is spatially correlated over that length instead of independent per pixel
+@traced
+def get_noisy_input_on_device(noise_prop: float, seeds, device, correlation_length_km=None):
+    init_conds = get_initial_condition().to(device)
+    batch = init_conds.repeat(len(seeds), 1, 1, 1, 1)   # a copy even on cpu, so the memory-mapped input is never written
+    if noise_prop != 0:
+        stds = get_noise_stds()
+        if correlation_length_km is not None:
+            add_correlated_noise(batch[:, 0], noise_prop, stds, seeds, correlation_length_km)
+        else:
+            for i, seed in enumerate(seeds):
+                add_member_noise(batch[i, 0], noise_prop, stds, seed)
+    return batch # shape: (members, timesteps, channels, lat, lon)
+
+# pick how many members fit in one forward pass given the memory currently free on device
+def pick_batch_size(device, init_cond_bytes, max_batch_size=MAX_BATCH_SIZE):
+    if device.type == "cuda":
+        free_bytes, _ = torch.cuda.mem_get_info(device)
+    else:
+        free_bytes = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    batch_size = int(0.8 * free_bytes // (init_cond_bytes * MEMBER_MEMORY_FACTOR))
+    return max(1, min(batch_size, max_batch_size))
+
 # generate fully random data from given distribution (normal, chi-sq, lognormal, uniform) with given parameters
+@traced
 def get_random_input(distribution: str = "normal", mean: float = 0, std: float = 1, df: float = 1, a: float = 0, b: float = 1):
     size = (1, 1, 73, 721, 1440) # batch size, timesteps, channels, latitudes, longitudes
     if distribution.lower()[0] == 'n': # normal
@@ -38,84 +90,155 @@ def get_random_input(distribution: str = "normal", mean: float = 0, std: float =
         print('Unknown distribution. Defaulting to N(0,1).')
         return torch.randn(*size)
 
-# load model, run inference, save forecast to NetCDF file
+# normalize x with the given per-channel stats instead of the model's own, without touching the model or MODEL_DIR.
+# the model normalizes its input with the stats in MODEL_DIR, (x - c) / s, so feeding it c + s * (x - mean) / std makes it
+# see (x - mean) / std, exactly as if it had been loaded with mean/std as its stats. its output then comes back
+# denormalized with c and s, i.e. already rescaled to the era5 distribution (what rescale_fcnv2_output used to do).
+# any number of runs with different stats can share one warm model this way
+def override_normalization(x, mean, std, model_dir=MODEL_DIR):
+    model_means, model_stds = load_era5_stats(model_dir)
+    return remap_normalization(x, mean, std, model_means, model_stds)
+
+# use gpu if available
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# feed a saved forecast to sinks step by step, as if it was being rolled out on device
+@traced
+def replay_forecast(forecast_path, sinks, device):
+    ds = load_dataset(forecast_path)
+    for step in range(ds.sizes['time']):
+        output = torch.from_numpy(ds['forecast'].isel(time=step).values).to(device)
+        for sink in sinks:
+            sink.consume(step, ds.time.values[step], output)
+    for sink in sinks:
+        sink.finalize()
+    ds.close()
+
+# load model, run inference, save forecast to NetCDF file.
+# sinks (see rollout_sinks.py) are fed each step while the rollout runs; set save_output=False to skip writing output_path.
+# capture (a CaptureSpec, see capture.py) limits output_path to some channels, a window of the grid, and/or some lead
+# times, cut out on the device before anything is copied to the host.
+# mode is "noise" (noise_prop * era5 stds of independent gaussian noise added to the real input), "correlated" (the same,
+# but spatially correlated over CORRELATION_LENGTH_KM), or "random" (fully random input from distribution).
+# with CACHE_FORECASTS, a saved forecast is also kept in the forecast cache, and a forecast that's already there is
+# replayed into the sinks and linked to output_path instead of being run again. only full forecasts are cached
+@traced
 def run_inference(
     mode: str = "noise", noise_prop: float = 0.0, distribution: str = "normal", 
     mean: float = 0, std: float = 1, df: float = 1, a: float = 0, b: float = 1, 
-    seed: float = 42, verbose: bool = False
+    seed: float = 42, verbose: bool = False, sinks = None, save_output: bool = True, output_path: str = PRED_PATH,
+    capture = None
     ):
-    # set seed for reproducibility
-    set_seed(seed)
+    cache = ForecastCache() if CACHE_FORECASTS and save_output and (capture is None or capture.is_full()) else None
+    if cache is not None:
+        cache_key = forecast_key(forecast_spec(mode, noise_prop, distribution, mean, std, df, a, b, seed))
+        cached_path = cache.get(cache_key, FORECAST_ARTIFACT)
+        if cached_path is not None:
+            replay_forecast(cached_path, sinks or [], get_device())
+            link_file(cached_path, output_path)
+            if verbose: print(f"Reused cached forecast for {output_path}!")
+            return
 
     # use gpu if available
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    # only used for random input
-    distr_mean = 0
-    distr_std = 1
+    device = get_device()
     
     # get the initial conditions
     if mode.lower()[0] == "n": # if noise mode, add Gaussian noise to real input
-        init_cond = get_noisy_input(noise_prop).to(device)
+        if NOISE_RNG == "torch":
+            set_seed(seed)  # set seed for reproducibility
+            init_cond = get_noisy_input(noise_prop).to(device)
+        else:
+            init_cond = get_noisy_input_on_device(noise_prop, [seed], device)
         if verbose: print("Successfully generated noisy initial condition!")
-    else: # if random mode, generate random initial condition and update channel means and stds
+    elif mode.lower()[0] == "c": # if correlated mode, add spatially correlated noise to real input
+        init_cond = get_noisy_input_on_device(noise_prop, [seed], device, CORRELATION_LENGTH_KM)
+        if verbose: print("Successfully generated correlated noisy initial condition!")
+    else: # if random mode, generate random initial condition and normalize it with the distribution's stats
+        set_seed(seed)  # set seed for reproducibility
         init_cond = get_random_input(distribution, mean, std, df, a, b).to(device)
-        distr_mean, distr_std = calc_mean_and_std_from_distr(distribution, mean, std, df, a, b)
-        create_synthetic_stats(MODEL_DIR, distr_mean, distr_std)
-        if verbose: print("Successfully generated random initial condition and updated channel stats!")
-    
-    # save path to modified files
-    pkg_dir = Path(MODEL_DIR).resolve()
-    
-    # load the model
-    model = get_model(f"file://{pkg_dir}")
-    model = model.to(device)  # move to gpu if available
+        init_cond = override_normalization(init_cond, *calc_mean_and_std_from_distr(distribution, mean, std, df, a, b))
+        if verbose: print("Successfully generated random initial condition and set its channel stats!")
     
-    if verbose:
-        print("Successfully loaded model!")
+    # load the model (or reuse the warm copy already loaded for this model dir, device, and stats)
+    model = get_cached_model(MODEL_DIR, device, verbose=verbose)
     
     # run inference
     time = datetime(2018, 9, 13, 0, 0)
-    predictions = []
-    times = []
+    sinks = list(sinks or [])
+    
+    # the forecast is written to output_path one step at a time as the rollout runs, so host memory stays at a few steps
+    # whatever the lead time. it's kept under a temporary name until it's complete, so a copy of an earlier forecast
+    # in the cache is replaced rather than overwritten, and a failed rollout leaves nothing behind
+    if save_output:
+        sinks.append(NetCDFSink(output_path, model.out_channel_names, model.grid.lat, model.grid.lon, capture=capture))
     
+    # the sinks run on a writer thread (with ASYNC_SINKS), so writing a step overlaps computing the next one
     iterator = model(time, init_cond)
-    for _ in tqdm(range(TIMESTEPS), desc="Generating forecast"):
-        temp_time, temp_output, _ = next(iterator)
-        predictions.append(temp_output[0].cpu().numpy())
-        times.append(temp_time)
+    with SinkPipeline([sinks], device) as pipeline:
+        for step in tqdm(range(TIMESTEPS), desc="Generating forecast"):
+            with trace_span("model step", step=step):
+                temp_time, temp_output, _ = next(iterator)
+            with trace_span("consume step", step=step):
+                pipeline.consume(step, temp_time, temp_output)
 
     if verbose:
         print("Successfully ran inference!")
+
+    if not save_output:
+        return
     
-    predictions = np.stack(predictions)     # shape: (timesteps, channels, lat, lon)
-
-    # if using random input, rescale output to match era5 distribution and restore channel stats
-    if mode.lower()[0] != "n":
-        if verbose: print("rescaling predictions and restoring channel stats")
-        predictions = rescale_fcnv2_output(predictions, ERA5_STATS_DIR, distr_mean, distr_std)
-        restore_channel_stats(MODEL_DIR, ERA5_STATS_DIR)
-
-    # convert to xarray dataset
-    data_arr = xr.DataArray(
-        predictions,
-        dims = ["time", "channel", "lat", "lon"],
-        coords = {
-            "time": times,
-            "channel": model.out_channel_names,
-            "lat": model.grid.lat,
-            "lon": model.grid.lon
-        },
-        name = "forecast"
-    )
-    ds = data_arr.to_dataset()
-    
+    if cache is not None:
+        cache.put(cache_key, FORECAST_ARTIFACT, output_path)
+
     if verbose:
-        print("Successfully converted to xarray dataset!")
-    
-    # save
-    ds.to_netcdf(PRED_PATH, mode='w')
-    ds.close()
+        print(f"Saved forecast to {output_path}!")
+
+# roll out several noise-mode (or correlated-mode) members per forward pass.
+# make_sinks(seed) returns the sinks for one member; returns {seed: that member's sinks} once they're all finalized.
+# on_batch_done({seed: sinks}) is called after every batch
+@traced
+def run_batched_inference(
+    noise_prop: float = 0.0, seeds = (42,), make_sinks = None, batch_size: int = None, verbose: bool = False, on_batch_done = None,
+    mode: str = "noise"
+    ):
+    # use gpu if available
+    device = get_device()
+
+    # load the model (or reuse the warm copy already loaded for this model dir, device, and stats)
+    model = get_cached_model(MODEL_DIR, device, verbose=verbose)
+
+    if batch_size is None:
+        batch_size = pick_batch_size(device, 4 * 73 * 721 * 1440)
+    if verbose: print(f"Running {len(seeds)} members in batches of {batch_size}")
+
+    time = datetime(2018, 9, 13, 0, 0)
+    member_sinks = {}
+    for start in range(0, len(seeds), batch_size):
+        batch_seeds = list(seeds[start:start + batch_size])
+        batch_sinks = [make_sinks(seed) if make_sinks else [] for seed in batch_seeds]
+        if mode.lower()[0] == "c":
+            init_cond = get_noisy_input_on_device(noise_prop, batch_seeds, device, CORRELATION_LENGTH_KM)
+        elif NOISE_RNG == "torch":
+            init_cond = get_noisy_input_batch(noise_prop, batch_seeds).to(device)
+        else:
+            init_cond = get_noisy_input_on_device(noise_prop, batch_seeds, device)
+
+        # each step is split back into per-member outputs for the members' sinks
+        iterator = model(time, init_cond)
+        with SinkPipeline(batch_sinks, device) as pipeline:
+            for step in tqdm(range(TIMESTEPS), desc=f"Generating {len(batch_seeds)} forecasts"):
+                with trace_span("model step", step=step, members=len(batch_seeds)):
+                    temp_time, temp_output, _ = next(iterator)
+                with trace_span("consume step", step=step, members=len(batch_seeds)):
+                    pipeline.consume(step, temp_time, temp_output)
+
+        member_sinks.update(zip(batch_seeds, batch_sinks))
+        del init_cond, iterator
+        if on_batch_done is not None:   # lets the caller record each batch as soon as it's done
+            on_batch_done(dict(zip(batch_seeds, batch_sinks)))
 
     if verbose:
-        print(f"Saved forecast to {PRED_PATH}!")
\ No newline at end of file
+        print("Successfully ran batched inference!")
+
+    return member_sinks
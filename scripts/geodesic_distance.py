@@ -0,0 +1,86 @@
+import numpy as np
+from geopy.distance import geodesic
+
+# Vectorized distance on the WGS-84 ellipsoid (Vincenty's inverse formula), for whole (members, time) track arrays
+# at once instead of one geopy call per point. Vincenty agrees with geopy's geodesic (Karney) to well under a meter;
+# the iteration can fail to converge only for nearly antipodal points, and those few fall back to geopy.
+
+WGS84_A = 6378.137              # semi-major axis (km)
+WGS84_F = 1 / 298.257223563     # flattening
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# distance in km between (lat1, lon1) and (lat2, lon2) in degrees. inputs broadcast against each other; the result has
+# their broadcast shape (a scalar for scalar inputs)
+def geodesic_km(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2)])
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = [np.atleast_1d(v) for v in (lat1, lon1, lat2, lon2)]
+    f = WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_U2 * sin_lam, cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam)
+            cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0., cos_U1 * cos_U2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # cos2_alpha is 0 only for points on the equator
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0., cos_sigma - 2 * sin_U1 * sin_U2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - lam_prev) < tol
+            if converged.all():
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+    ))
+    dist = WGS84_B * A * (sigma - delta_sigma)
+
+    # nearly antipodal points: let geopy (Karney's algorithm) handle them
+    for idx in map(tuple, np.argwhere(~converged | ~np.isfinite(dist))):
+        dist[idx] = geodesic((lat1[idx], lon1[idx]), (lat2[idx], lon2[idx])).km
+    return dist.reshape(shape)[()]
+
+# per-step and cumulative track errors (km). pred arrays are (time,) or (members, time), the true track is (time,)
+def track_errors(true_lats, true_lons, pred_lats, pred_lons):
+    step_errors = geodesic_km(true_lats, true_lons, pred_lats, pred_lons)
+    return step_errors, np.cumsum(step_errors, axis=-1)
+
+# largest difference (km) between geodesic_km and geopy over random point pairs (optionally near each other)
+def max_difference_from_geopy(num_pairs=2000, max_separation=None, seed=0):
+    rng = np.random.default_rng(seed)
+    lat1 = rng.uniform(-90, 90, num_pairs)
+    lon1 = rng.uniform(-180, 180, num_pairs)
+    if max_separation is None:
+        lat2 = rng.uniform(-90, 90, num_pairs)
+        lon2 = rng.uniform(-180, 180, num_pairs)
+    else:
+        lat2 = np.clip(lat1 + rng.uniform(-max_separation, max_separation, num_pairs), -90, 90)
+        lon2 = lon1 + rng.uniform(-max_separation, max_separation, num_pairs)
+    ours = geodesic_km(lat1, lon1, lat2, lon2)
+    reference = np.array([geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+    return np.max(np.abs(ours - reference))
+
+if __name__ == "__main__":
+    print(f"max difference from geopy (global pairs): {max_difference_from_geopy() * 1000:.6f} m")
+    print(f"max difference from geopy (pairs within 10 deg): {max_difference_from_geopy(max_separation=10) * 1000:.6f} m")
+    # nearly antipodal pairs, where Vincenty doesn't converge and geopy is used instead
+    lats = np.linspace(-60, 60, 50)
+    ours = geodesic_km(lats, 0., -lats + 0.01, 179.8)
+    reference = np.array([geodesic((lat, 0.), (-lat + 0.01, 179.8)).km for lat in lats])
+    print(f"max difference from geopy (nearly antipodal pairs): {np.max(np.abs(ours - reference)) * 1000:.6f} m")
@@ -0,0 +1,93 @@
+import os
+import json
+import numpy as np
+from tqdm import tqdm
+from load_data import load_dataset
+from tracing import traced
+from config import TRUE_PATH, IC_STORE_DIR
+
+# Memory-mapped copy of fcnv2_input.nc: a (time, channel, lat, lon) float32 .npy file plus a json sidecar
+# with the coordinates and the fingerprint of the NetCDF file it was built from.
+# Every process that opens the store maps the same file, so workers share it through the page cache.
+
+STORE_DATA_FILE = "forecast.npy"
+STORE_META_FILE = "meta.json"
+
+# one open memmap per store directory per process
+_OPEN_STORES = {}
+
+def source_fingerprint(nc_path):
+    stat = os.stat(nc_path)
+    return {"path": os.path.abspath(nc_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def load_store_metadata(store_dir=IC_STORE_DIR):
+    try:
+        with open(os.path.join(store_dir, STORE_META_FILE), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+# store is current if it exists and was built from the NetCDF file as it is now
+def is_store_current(nc_path=TRUE_PATH, store_dir=IC_STORE_DIR):
+    meta = load_store_metadata(store_dir)
+    if meta is None or not os.path.exists(os.path.join(store_dir, STORE_DATA_FILE)):
+        return False
+    return meta["source"] == source_fingerprint(nc_path)
+
+# one-time conversion of the NetCDF file into the store, copying one timestep at a time
+@traced
+def build_ic_store(nc_path=TRUE_PATH, store_dir=IC_STORE_DIR, verbose=False):
+    os.makedirs(store_dir, exist_ok=True)
+    ds = load_dataset(nc_path)
+    data = ds['forecast']
+    lat_name, lon_name = data.dims[-2], data.dims[-1]  # era5 file uses latitude/longitude
+
+    # write under a per-process temporary name so concurrent builders never see a half-written store
+    data_path = os.path.join(store_dir, STORE_DATA_FILE)
+    tmp_path = data_path + f".{os.getpid()}.tmp"
+    store = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=data.shape)
+    for t in tqdm(range(data.shape[0]), desc="Building initial condition store", disable=not verbose):
+        store[t] = data.isel(time=t).values
+    store.flush()
+    del store
+    os.replace(tmp_path, data_path)
+
+    meta = {
+        "source": source_fingerprint(nc_path),
+        "shape": list(data.shape),
+        "time": [str(t) for t in ds.time.values],
+        "channel": [str(c) for c in ds.channel.values],
+        "lat": ds[lat_name].values.tolist(),
+        "lon": ds[lon_name].values.tolist(),
+    }
+    meta_path = os.path.join(store_dir, STORE_META_FILE)
+    with open(meta_path + f".{os.getpid()}.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + f".{os.getpid()}.tmp", meta_path)
+    ds.close()
+    _OPEN_STORES.pop(store_dir, None)
+    if verbose: print(f"Saved initial condition store to {store_dir}!")
+
+# map the store (building it first if missing or stale). shape: (time, channel, lat, lon)
+def open_ic_store(nc_path=TRUE_PATH, store_dir=IC_STORE_DIR):
+    if store_dir in _OPEN_STORES:
+        return _OPEN_STORES[store_dir]
+    if not is_store_current(nc_path, store_dir):
+        build_ic_store(nc_path, store_dir)
+    # copy-on-write mapping: pages come from the shared page cache, and any in-place write stays private to this process
+    store = np.load(os.path.join(store_dir, STORE_DATA_FILE), mmap_mode="c")
+    _OPEN_STORES[store_dir] = store
+    return store
+
+# zero-copy view of the t=0 initial condition, shape: (channel, lat, lon)
+def get_initial_condition_view(nc_path=TRUE_PATH, store_dir=IC_STORE_DIR):
+    return open_ic_store(nc_path, store_dir)[0]
+
+# zero-copy view of era5 truth at a given lead time index (0 = initialization, 1 = +6 hours, ...)
+def get_truth_view(lead_time_idx, nc_path=TRUE_PATH, store_dir=IC_STORE_DIR):
+    return open_ic_store(nc_path, store_dir)[lead_time_idx]
+
+# find the index of a specified channel in the store
+def get_store_channel_index(channel_name, nc_path=TRUE_PATH, store_dir=IC_STORE_DIR):
+    open_ic_store(nc_path, store_dir)  # make sure metadata is current
+    return load_store_metadata(store_dir)["channel"].index(channel_name)
@@ -2,10 +2,15 @@ import numpy as np
 import xarray as xr
 import json
 import os
+from tracing import traced
 from config import ERA5_STATS_DIR
 
-# retrieve dataset from netcdf file
+# retrieve dataset from netcdf file or zarr store (datasets that are already open are passed through)
 def load_dataset(dataset_path):
+    if isinstance(dataset_path, xr.Dataset):
+        return dataset_path
+    if os.path.exists(os.path.join(dataset_path, "zarr.json")):
+        return xr.open_zarr(dataset_path, chunks=None, consolidated=False)  # lazy: only the chunks that get indexed are read
     return xr.open_dataset(dataset_path, engine='netcdf4')
 
 # find the index of a specified channel
@@ -17,17 +22,45 @@ def get_channel_data(ds, channel_name):
     return ds['forecast'].isel(channel=get_channel_index(ds, channel_name))
 
 # get global data as numpy array
+@traced
 def get_all_data_values(data_path):
     return load_dataset(data_path)['forecast'].values
 
-# get local data as numpy array
+# rows (or columns) start:stop:stride of the global grid, as a slice of data whose grid starts at global index offset and
+# keeps every grid_stride-th point (see capture.py; full fields have offset 0 and grid_stride 1)
+def _local_slice(start, stop, stride, offset, grid_stride, size):
+    end = -(-(stop - offset) // grid_stride)
+    if start < offset or (start - offset) % grid_stride or stride % grid_stride or end > size:
+        raise ValueError(f"data on grid points {offset}:{offset + size * grid_stride}:{grid_stride} doesn't cover {start}:{stop}:{stride}")
+    return slice((start - offset) // grid_stride, end, stride // grid_stride)
+
+# raise if data was captured at lead times other than the leading steps: its steps can't be paired with the truth's
+# (or another forecast's) by position
+def check_leading_steps(data):
+    lead_times = data.attrs.get("lead_times")
+    if lead_times is None:
+        return
+    lead_times = [int(step) for step in np.atleast_1d(lead_times)]
+    if lead_times != list(range(len(lead_times))):
+        raise ValueError(f"forecast was captured at lead times {lead_times}, not at the leading steps")
+
+# get local data as numpy array (lat and lon must be the last two dims). x and y are global grid indices, also for data
+# captured over a window. data captured at lead times other than the leading steps is refused
 def limit_data(data, timesteps, x_min, x_max, y_min, y_max, stride = 1):
-    return data[:timesteps, y_min:y_max:stride, x_min:x_max:stride].values
+    check_leading_steps(data)
+    grid_stride = int(data.attrs.get("stride", 1))
+    rows = _local_slice(y_min, y_max, stride, int(data.attrs.get("y_offset", 0)), grid_stride, data.shape[-2])
+    cols = _local_slice(x_min, x_max, stride, int(data.attrs.get("x_offset", 0)), grid_stride, data.shape[-1])
+    return data.isel(time=slice(None, timesteps))[..., rows, cols].values
+
+# whether a forecast holds the whole grid (a capture over a window or with a stride doesn't)
+def is_global_forecast(ds):
+    return "y_offset" not in ds['forecast'].attrs
 
-# load the means and stds of era5 dataset for all channels
-def load_era5_stats():
-    era5_means = np.load(os.path.join(ERA5_STATS_DIR, "global_means.npy"))
-    era5_stds = np.load(os.path.join(ERA5_STATS_DIR, "global_stds.npy"))
+# load the means and stds of era5 dataset for all channels (or the stats in another directory, e.g. MODEL_DIR)
+def load_era5_stats(stats_dir=ERA5_STATS_DIR):
+    era5_means = np.load(os.path.join(stats_dir, "global_means.npy"))
+    era5_stds = np.load(os.path.join(stats_dir, "global_stds.npy"))
     return era5_means, era5_stds
 
 # retrieve the mean and std from era5 for a specific channel
@@ -51,6 +84,11 @@ def load_json(json_path):
 
     return error_log
 
+# written to a temporary file that replaces json_path, so a crash never leaves a truncated file behind
 def update_json(json_path, error_log):
-    with open(json_path, "w") as f:
-        json.dump(error_log, f, indent=2)
\ No newline at end of file
+    tmp_path = json_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(error_log, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, json_path)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import os
+import json
+from config import RETAINED_DIR, RETAINED_INDEX_PATH, RETAIN_K, NUM_EXPERIMENTS
+
+# Retention policy for noise-sweep member outputs.
+# Every member writes its retained channels to RETAINED_DIR while it runs; once its final tracking error is known,
+# only members that can still end up among the k best, the k worst, or the median of their noise level are kept.
+# With members_per_level known, a member currently at rank r (of n so far) can only move down to rank r + (N - n),
+# so this never deletes a member that the finished sweep would pick.
+# The index (noise_pct -> seed -> {"error", "path"}) is what the visualization and export stages read.
+
+def load_retention_index(index_path=RETAINED_INDEX_PATH):
+    try:
+        with open(index_path, "r") as f:
+            temp = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {
+        float(noise_pct): {int(seed): entry for seed, entry in seed_dict.items()}
+        for noise_pct, seed_dict in temp.items()
+    }
+
+def save_retention_index(index, index_path=RETAINED_INDEX_PATH):
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+# where a member's retained output is written while the sweep runs
+def retained_member_path(noise_pct, seed, retained_dir=RETAINED_DIR):
+    return os.path.join(retained_dir, f"noise{round(noise_pct * 100):02d}", f"seed{seed}.nc")
+
+# path of a member's retained output, or None if it was never retained or has been evicted
+def get_retained_path(index, noise_pct, seed):
+    entry = index.get(noise_pct, {}).get(seed)
+    if entry is None or entry["path"] is None or not os.path.exists(entry["path"]):
+        return None
+    return entry["path"]
+
+# ranks (0 = lowest error) that may still be among the k best, k worst, or the median once all members are in
+def ranks_to_keep(num_members, members_per_level, k):
+    total = max(members_per_level, num_members)
+    remaining = total - num_members
+    median_rank = total // 2
+    return [
+        rank for rank in range(num_members)
+        if rank < k or rank >= num_members - k or rank <= median_rank <= rank + remaining
+    ]
+
+# delete the outputs of members of one noise level (seed -> entry) that can no longer be selected
+def evict_members(level, members_per_level, k):
+    # sort is stable, so ties keep insertion order just like the best/median/worst selection in the pipelines
+    ranked = sorted(level.items(), key=lambda item: item[1]["error"])
+    keep = set(ranks_to_keep(len(ranked), members_per_level, k))
+    for rank, (_, entry) in enumerate(ranked):
+        if rank not in keep and entry["path"] is not None:
+            if os.path.exists(entry["path"]):
+                os.remove(entry["path"])
+            entry["path"] = None
+
+# combine the indices written by the workers of a sharded sweep (each only saw its own members) and evict what
+# the combined ranking rules out. members are put back in sweep order (seed_order) so ties rank as in a single-process
+# sweep; every worker ran its members in that order and ranked against the full members_per_level, so nothing the
+# combined ranking needs was evicted by a worker
+def merge_retention_indices(indices, seed_order, members_per_level=NUM_EXPERIMENTS, k=RETAIN_K):
+    position = {seed: idx for idx, seed in enumerate(seed_order)}
+    merged = {}
+    for index in indices:
+        for noise_pct, seed_dict in index.items():
+            level = merged.setdefault(noise_pct, {})
+            for seed, entry in seed_dict.items():
+                level.setdefault(seed, entry)
+    for noise_pct, level in merged.items():
+        merged[noise_pct] = {seed: level[seed] for seed in sorted(level, key=position.get)}
+        evict_members(merged[noise_pct], members_per_level, k)
+    return merged
+
+class MemberRetention:
+    def __init__(self, index_path=RETAINED_INDEX_PATH, k=RETAIN_K, members_per_level=NUM_EXPERIMENTS):
+        self.index_path = index_path
+        self.k = k
+        self.members_per_level = members_per_level
+        self.index = load_retention_index(index_path)
+
+    # register a finished member whose output is at path, then evict members that can no longer be selected
+    def add(self, noise_pct, seed, final_error, path):
+        level = self.index.setdefault(noise_pct, {})
+        if seed in level:   # already registered (e.g. a resumed sweep), keep the first result
+            return
+        level[seed] = {"error": float(final_error), "path": path}
+        evict_members(level, self.members_per_level, self.k)
+        save_retention_index(self.index, self.index_path)
@@ -0,0 +1,56 @@
+import os
+import hashlib
+import torch
+from pathlib import Path
+from earth2mip.networks import get_model
+from tracing import traced
+
+# process-level registry of warm models: (model dir, device, normalization stats fingerprint) -> model
+_MODEL_CACHE = {}
+
+# hash the normalization stats in model_dir so a model loaded with different stats is never reused
+def stats_fingerprint(model_dir):
+    digest = hashlib.sha1()
+    for filename in ["global_means.npy", "global_stds.npy"]:
+        with open(os.path.join(model_dir, filename), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def model_cache_key(model_dir, device):
+    pkg_dir = str(Path(model_dir).resolve())
+    return (pkg_dir, str(torch.device(device)), stats_fingerprint(pkg_dir))
+
+# load the model once per key and hand back the warm copy on every later call
+@traced
+def get_cached_model(model_dir, device, verbose=False):
+    key = model_cache_key(model_dir, device)
+    model = _MODEL_CACHE.get(key)
+    if model is not None:
+        if verbose: print("Reusing cached model!")
+        return model
+
+    # drop any copy of this model loaded with stale stats so it doesn't hold on to device memory
+    invalidate_model_cache(model_dir, device)
+    model = get_model(f"file://{key[0]}")
+    model = model.to(device)  # move to gpu if available
+    _MODEL_CACHE[key] = model
+    if verbose: print("Successfully loaded model!")
+    return model
+
+# put an already loaded model in the registry, e.g. a stand-in for the real weights (see synthetic_data.SyntheticModel);
+# every later get_cached_model call for model_dir and device returns it
+def register_model(model_dir, device, model):
+    _MODEL_CACHE[model_cache_key(model_dir, device)] = model
+
+# remove cached models (all of them by default, or only those matching model_dir and/or device)
+def invalidate_model_cache(model_dir=None, device=None):
+    pkg_dir = str(Path(model_dir).resolve()) if model_dir is not None else None
+    device = str(torch.device(device)) if device is not None else None
+    for key in list(_MODEL_CACHE):
+        if pkg_dir is not None and key[0] != pkg_dir:
+            continue
+        if device is not None and key[1] != device:
+            continue
+        del _MODEL_CACHE[key]
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
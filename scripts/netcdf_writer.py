@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import netCDF4
+from datetime import datetime
+
+# Incremental writer for (time, channel, lat, lon) "forecast" NetCDF files laid out like the ones run_inference
+# has always produced, so load_dataset and everything downstream reads them unchanged.
+# The time dimension is unlimited and each step (or single channel of a step) is written as soon as it's available,
+# so memory stays at one step no matter how long the rollout is.
+# Data goes to a temporary file that replaces `path` on close, so readers never see a half-written forecast.
+class ForecastNetCDFWriter:
+    def __init__(self, path, channel_names, lat, lon, lat_name="lat", lon_name="lon", zlib=False, attrs=None):
+        self.path = path
+        self.tmp_path = path + f".{os.getpid()}.tmp"
+        self.time_units = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.ds = netCDF4.Dataset(self.tmp_path, mode="w", format="NETCDF4")
+        self.ds.createDimension("time", None)
+        self.ds.createDimension("channel", len(channel_names))
+        self.ds.createDimension(lat_name, len(lat))
+        self.ds.createDimension(lon_name, len(lon))
+
+        channel_var = self.ds.createVariable("channel", str, ("channel",))
+        channel_var[:] = np.array(channel_names, dtype=object)
+        self.ds.createVariable(lat_name, "f8", (lat_name,))[:] = np.asarray(lat)
+        self.ds.createVariable(lon_name, "f8", (lon_name,))[:] = np.asarray(lon)
+        self.time_var = self.ds.createVariable("time", "f8", ("time",))
+        self.time_var.calendar = "proleptic_gregorian"
+
+        self.forecast = self.ds.createVariable(
+            "forecast", "f4", ("time", "channel", lat_name, lon_name),
+            chunksizes=(1, 1, len(lat), len(lon)), zlib=zlib
+        )
+        if attrs:   # e.g. where a captured window sits in the global grid (see capture.py)
+            self.forecast.setncatts(attrs)
+
+    def set_time(self, t, time):
+        if self.time_units is None:  # anchor the time axis on the first step written
+            self.time_units = f"hours since {np.datetime64(time, 's').astype(datetime):%Y-%m-%d %H:%M:%S}"
+            self.time_var.units = self.time_units
+        self.time_var[t] = netCDF4.date2num(np.datetime64(time, 's').astype(datetime), self.time_units, self.time_var.calendar)
+
+    # data shape: (channel, lat, lon)
+    def write_step(self, t, time, data):
+        self.set_time(t, time)
+        self.forecast[t] = np.asarray(data, dtype=np.float32)
+
+    # data shape: (lat, lon)
+    def write_channel(self, t, channel_idx, data):
+        self.forecast[t, channel_idx] = np.asarray(data, dtype=np.float32)
+
+    def close(self):
+        if self.ds is None:
+            return
+        self.ds.close()
+        self.ds = None
+        os.replace(self.tmp_path, self.path)
+
+    # drop the partial file instead of publishing it (used when the writer fails part-way)
+    def abort(self):
+        if self.ds is not None:
+            self.ds.close()
+            self.ds = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
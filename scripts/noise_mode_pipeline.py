@@ -1,163 +1,191 @@
 import sys
 import os
+import shutil
 from generate_forecast import run_inference
-from compute_error import update_error_log, generate_global_error_dataset
+from noise_sweep import run_noise_sweep, sweep_description
+from experiment_ledger import ExperimentLedger, load_ledger_error_log
+from sweep_runner import launch_shards, merge_shards
+from compute_error import open_error_view
+from error_stats import load_error_stats, stats_cache_path
 from retrieve_era5_data import retrieve_era5_data
+from ic_store import open_ic_store
+from member_retention import load_retention_index, get_retained_path
+from ensemble_store import load_member
 from visualize_forecast import *
+from render_scheduler import RenderJob, run_render_jobs
 from plot_errors import *
 from config import *
 
-if RETRIEVE_DATA:
-    retrieve_era5_data()    # may take a few minutes
-
-error_log = {}
-
-# run all experiments and save error log
-if PREDICT:
-    seed_idx = 0
-    for noise_pct in NOISE_PCTS:
-        for _ in range(NUM_EXPERIMENTS):
-            seed = SEEDS[seed_idx]
-            print(f"Generating forecast with noise {noise_pct} and seed {seed}...")
-            run_inference(noise_prop=noise_pct, seed=seed, verbose = False)
-            print("Updating error log...")
-            update_error_log(error_log, noise_pct, seed, TRUE_PATH, PRED_PATH, TIMESTEPS)
-            seed_idx += 1
-    if not CLEAN_UP:
-        update_json(ERROR_LOG_PATH, error_log)
-else:   # or just load error log from memory
-    print("Loading error log...")
-    error_log = load_json(ERROR_LOG_PATH)
-
-if not error_log:   # must either have error log in memory or generate a new one
-    print("error log empty.")
-    sys.exit(1)
-
-worst_seeds = {}
-median_seeds = {}
-best_seeds = {}
-
-if PLOT_ERROR_LOCAL:
-    plot_tracking_error_vs_noise(LOCAL_ERR_PLOT_DIR, error_log)
-    # plot_tracking_error_vs_time_all_noise(LOCAL_ERR_PLOT_DIR, error_log)
-
-# calculate best, median, and worst seeds for each noise level
-for noise_pct, seed2error in error_log.items():
-    total_errors = [(seed, errors[-1]) for seed, errors in seed2error.items()]
-    total_errors.sort(key = lambda x: x[1])
-    
-    best_seeds[noise_pct] = total_errors[0][0]
-    median_seeds[noise_pct] = total_errors[len(total_errors) // 2][0]
-    worst_seeds[noise_pct] = total_errors[-1][0]
-
-# global visualization of ERA5 data
-if VISUALIZE_GLOBAL:
-    print("Visualizing original data globally...")
-    original_global_plot_dir = os.path.join(GLOBAL_PRED_PLOT_DIR, "original")
-    for channel in CHANNELS:
-        visualize_global(
-            original_global_plot_dir, TRUE_PATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
-            title_prefix = f"FourCastNetv2 Hurricane Florence Prediction - Original Data - {channel}", 
-            filename_prefix = f"{channel}_original"
-        )
-        animate_frames(
-            os.path.join(original_global_plot_dir, channel), 
-            animation_name = f"animated_{channel}_original.gif"
-        )
-
-# local and global visualizations of forecasts and errors
-if VISUALIZE_LOCAL or VISUALIZE_GLOBAL or PLOT_ERROR_LOCAL or PLOT_ERROR_GLOBAL:
-    for noise_pct in NOISE_PCTS:
-        for label, seed_dict in [("best", best_seeds), ("median", median_seeds), ("worst", worst_seeds)]:
-            noise_str = f"noise{int(noise_pct*100):02d}"
-            seed = seed_dict[noise_pct]
-            
-            print(f"Regenerating forecast with noise {noise_pct} and {label} seed {seed}...")
-            run_inference(noise_prop=noise_pct, seed=seed, verbose=False)
-
-            if VISUALIZE_LOCAL:
-                print(f"Visualizing {label} seed locally...")
-                plot_dir = os.path.join(LOCAL_PRED_PLOT_DIR, noise_str, label)
-                visualize_local(plot_dir, TRUE_PATH, PRED_PATH, noise_pct, TIMESTEPS)
-                animate_frames(plot_dir, animation_name=f"animated_{label}_{noise_str}.gif", duration=1000)
-                visualize_local_trajectories_only(
-                    plot_dir, TRUE_PATH, PRED_PATH, TIMESTEPS,
-                    title = f"Hurricane Florence True vs. Predicted Trajectories ({noise_pct * 100:.0f}% noise)",
-                    filename = f"traj_only_{label}_{noise_str}.png"
-                )
+# the whole noise-mode pipeline: sweep (or load the error log), then plots. kept out of module level because render
+# workers are spawned, and each re-imports this module
+def main():
+    if RETRIEVE_DATA:
+        retrieve_era5_data()    # may take a few minutes
 
-            if VISUALIZE_GLOBAL:
-                print(f"Visualizing {label} seed globally...")
-                plot_dir = os.path.join(GLOBAL_PRED_PLOT_DIR, noise_str, label)
-                for channel in CHANNELS:
-                    visualize_global(
-                        plot_dir, PRED_PATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
-                        title_prefix = f"FourCastNetv2 Hurricane Florence Prediction - {noise_pct * 100.}% noise - {channel}", 
-                        filename_prefix = f"{channel}_{noise_str}"
-                    )
-                    animate_frames(os.path.join(plot_dir, channel), animation_name=f"animated_{channel}_{label}_{noise_str}.gif")
-
-            # must create error dataset for error visualization
-            generate_global_error_dataset(ERROR_DATAPATH, TRUE_PATH, PRED_PATH)
-            
-            if PLOT_ERROR_LOCAL:
-                print(f"Plotting {label} local errors...")
-                plot_dir = os.path.join(LOCAL_ERR_PLOT_DIR, noise_str, label)
-                for channel in CHANNELS:
-                    plot_pixelwise_error_hists(
-                        os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS,
-                        title = f"{int(noise_pct*100)}% Noise Added", 
-                        filename_prefix = f"{channel}_error_hist_{label}_{noise_str}",
-                        mode = 'local'
-                    )
-                    plot_pixelwise_error_summary(
-                        os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
-                        title = f"{int(noise_pct*100)}% Noise Added", 
-                        filename = f"{channel}_error_summary_{label}_{noise_str}",
-                        mode = 'local'
-                    )
-                    plot_pixelwise_error_moments(
-                        os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
-                        title = f"{int(noise_pct*100)}% Noise Added", 
-                        filename = f"{channel}_error_moments_{label}_{noise_str}",
-                        mode = 'local'
-                    )
-                    
-
-            if PLOT_ERROR_GLOBAL:
-                print(f"Plotting {label} global errors...")
-                plot_dir = os.path.join(GLOBAL_ERR_PLOT_DIR, noise_str, label)
-                for channel in CHANNELS:
-                    visualize_global(
-                        plot_dir, ERROR_DATAPATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
-                        title_prefix = f"FourCastNetv2 Hurricane Florence Prediction Error - {noise_pct * 100.}% noise - {channel}", 
-                        filename_prefix = f"{channel}_error_{noise_str}",
-                        is_error_plot = True
-                    )
-                    animate_frames(os.path.join(plot_dir, channel), animation_name=f"animated_error_{channel}_{label}_{noise_str}.gif")
-                    plot_pixelwise_error_hists(
-                        os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS,
-                        title = f"{int(noise_pct*100)}% Noise Added", 
-                        filename_prefix = f"{channel}_error_hist_{label}_{noise_str}"
-                    )
-                    plot_pixelwise_error_summary(
-                        os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
-                        title = f"{int(noise_pct*100)}% Noise Added", 
-                        filename = f"{channel}_error_summary_{label}_{noise_str}"
-                    )
-                    plot_pixelwise_error_moments(
-                        os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
-                        title = f"{int(noise_pct*100)}% Noise Added", 
-                        filename = f"{channel}_error_moments_{label}_{noise_str}"
+    error_log = {}
+
+    # run all experiments and save error log
+    if PREDICT:
+        open_ic_store(TRUE_PATH)    # one-time conversion of the era5 input into a memory-mapped store shared by all members
+        # every finished member goes to the ledger right away; with RESUME, members already in it are skipped
+        if not RESUME:
+            for directory in [RETAINED_DIR, SHARD_DIR]:
+                if os.path.exists(directory):
+                    shutil.rmtree(directory)    # a fresh sweep must not pick up members retained by an earlier one
+        if SWEEP_PROCESSES > 1:     # split the sweep across local processes (one GPU each), then combine their results
+            launch_shards(SWEEP_PROCESSES)
+            error_log = merge_shards()
+        else:
+            ledger = ExperimentLedger(sweep_description(), resume=RESUME)
+            error_log = ledger.error_log
+            run_noise_sweep(error_log, ledger)  # hurricane is tracked while each forecast runs, full fields are only written if SAVE_FULL_FIELDS
+        if not CLEAN_UP:
+            update_json(ERROR_LOG_PATH, error_log)
+    else:   # or just load error log from memory (or from the ledger of a sweep that didn't finish)
+        print("Loading error log...")
+        error_log = load_json(ERROR_LOG_PATH) or load_ledger_error_log()
+
+    if not error_log:   # must either have error log in memory or generate a new one
+        print("error log empty.")
+        sys.exit(1)
+
+    worst_seeds = {}
+    median_seeds = {}
+    best_seeds = {}
+
+    if PLOT_ERROR_LOCAL:
+        plot_tracking_error_vs_noise(LOCAL_ERR_PLOT_DIR, error_log)
+        # plot_tracking_error_vs_time_all_noise(LOCAL_ERR_PLOT_DIR, error_log)
+
+    # calculate best, median, and worst seeds for each noise level
+    for noise_pct, seed2error in error_log.items():
+        total_errors = [(seed, errors[-1]) for seed, errors in seed2error.items()]
+        total_errors.sort(key = lambda x: x[1])
+
+        best_seeds[noise_pct] = total_errors[0][0]
+        median_seeds[noise_pct] = total_errors[len(total_errors) // 2][0]
+        worst_seeds[noise_pct] = total_errors[-1][0]
+
+    render_jobs = []
+
+    # global visualization of ERA5 data
+    if VISUALIZE_GLOBAL:
+        original_global_plot_dir = os.path.join(GLOBAL_PRED_PLOT_DIR, "original")
+        for channel in CHANNELS:
+            render_jobs += global_render_jobs(
+                original_global_plot_dir, TRUE_PATH, channel, TIMESTEPS,
+                title_prefix = f"FourCastNetv2 Hurricane Florence Prediction - Original Data - {channel}", 
+                filename_prefix = f"{channel}_original",
+                animation_name = f"animated_{channel}_original.gif"
+            )
+
+    # local and global visualizations of forecasts and errors.
+    # data (forecasts and error datasets) is prepared here one member at a time, the plots themselves are collected as
+    # render jobs and drawn afterwards, in parallel if PARALLEL_RENDER
+    if VISUALIZE_LOCAL or VISUALIZE_GLOBAL or PLOT_ERROR_LOCAL or PLOT_ERROR_GLOBAL:
+        retention_index = load_retention_index()
+        needs_global = VISUALIZE_GLOBAL or PLOT_ERROR_LOCAL or PLOT_ERROR_GLOBAL   # error views are made on the whole grid
+        for noise_pct in NOISE_PCTS:
+            for label, seed_dict in [("best", best_seeds), ("median", median_seeds), ("worst", worst_seeds)]:
+                noise_str = f"noise{int(noise_pct*100):02d}"
+                seed = seed_dict[noise_pct]
+
+                # read the member kept by the sweep (or saved in the ensemble store), only re-run inference if neither has it.
+                # a member retained over the local window only is enough for the local plots
+                pred_path = get_retained_path(retention_index, noise_pct, seed)
+                if pred_path is not None and needs_global and not is_global_forecast(load_dataset(pred_path)):
+                    pred_path = None
+                if pred_path is None:
+                    pred_path = load_member(noise_pct, seed)
+                if pred_path is None:
+                    print(f"Regenerating forecast with noise {noise_pct} and {label} seed {seed}...")
+                    pred_path = os.path.join(REGENERATED_DIR, f"{noise_str}_{label}.nc")
+                    run_inference(mode=PERTURBATION, noise_prop=noise_pct, seed=seed, verbose=False, output_path=pred_path)
+
+                if VISUALIZE_LOCAL:
+                    plot_dir = os.path.join(LOCAL_PRED_PLOT_DIR, noise_str, label)
+                    render_jobs += local_render_jobs(
+                        plot_dir, TRUE_PATH, pred_path, noise_pct, TIMESTEPS,
+                        animation_name = f"animated_{label}_{noise_str}.gif",
+                        traj_title = f"Hurricane Florence True vs. Predicted Trajectories ({noise_pct * 100:.0f}% noise)",
+                        traj_filename = f"traj_only_{label}_{noise_str}.png"
                     )
 
-if CLEAN_UP:
-    if os.path.exists(PRED_PATH):
-        print("Deleting forecast...")
-        os.remove(PRED_PATH)
-    if os.path.exists(ERROR_LOG_PATH):
-        print("Deleting error log...")
-        os.remove(ERROR_LOG_PATH)
-    if os.path.exists(ERROR_DATAPATH):
-        print("Deleting error dataset...")
-        os.remove(ERROR_DATAPATH)
+                if VISUALIZE_GLOBAL:
+                    plot_dir = os.path.join(GLOBAL_PRED_PLOT_DIR, noise_str, label)
+                    for channel in CHANNELS:
+                        render_jobs += global_render_jobs(
+                            plot_dir, pred_path, channel, TIMESTEPS,
+                            title_prefix = f"FourCastNetv2 Hurricane Florence Prediction - {noise_pct * 100.}% noise - {channel}", 
+                            filename_prefix = f"{channel}_{noise_str}",
+                            animation_name = f"animated_{channel}_{label}_{noise_str}.gif"
+                        )
+
+                if not (PLOT_ERROR_LOCAL or PLOT_ERROR_GLOBAL):
+                    continue
+
+                # lazy pred - truth view for error visualization (nothing is written out, chunks are read as the plots need them)
+                error_view = open_error_view(
+                    TRUE_PATH, pred_path, TIMESTEPS, stats_path=os.path.join(ERROR_DIR, f"{noise_str}_{label}.stats.npz")
+                )
+                load_error_stats(error_view, CHANNELS)  # one pass over the errors, every error plot reads the cached stats
+
+                error_plots = []
+                if PLOT_ERROR_LOCAL:
+                    error_plots.append((os.path.join(LOCAL_ERR_PLOT_DIR, noise_str, label), 'local'))
+                if PLOT_ERROR_GLOBAL:
+                    error_plots.append((os.path.join(GLOBAL_ERR_PLOT_DIR, noise_str, label), 'global'))
+
+                for plot_dir, mode in error_plots:
+                    for channel in CHANNELS:
+                        if mode == 'global':
+                            render_jobs += global_render_jobs(
+                                plot_dir, error_view, channel, TIMESTEPS,
+                                title_prefix = f"FourCastNetv2 Hurricane Florence Prediction Error - {noise_pct * 100.}% noise - {channel}", 
+                                filename_prefix = f"{channel}_error_{noise_str}",
+                                animation_name = f"animated_error_{channel}_{label}_{noise_str}.gif",
+                                is_error_plot = True
+                            )
+                        channel_dir = os.path.join(plot_dir, channel)
+                        title = f"{int(noise_pct*100)}% Noise Added"
+                        render_jobs += [
+                            RenderJob(
+                                f"{channel_dir}/{channel}_error_hist_{label}_{noise_str}", plot_pixelwise_error_hists,
+                                (channel_dir, error_view, channel, TIMESTEPS, title, f"{channel}_error_hist_{label}_{noise_str}", mode)
+                            ),
+                            RenderJob(
+                                f"{channel_dir}/{channel}_error_summary_{label}_{noise_str}", plot_pixelwise_error_summary,
+                                (channel_dir, error_view, channel, TIMESTEPS, title, f"{channel}_error_summary_{label}_{noise_str}", mode)
+                            ),
+                            RenderJob(
+                                f"{channel_dir}/{channel}_error_moments_{label}_{noise_str}", plot_pixelwise_error_moments,
+                                (channel_dir, error_view, channel, TIMESTEPS, title, f"{channel}_error_moments_{label}_{noise_str}", mode)
+                            ),
+                        ]
+
+    if render_jobs:
+        print(f"Rendering {len(render_jobs)} plots and animations...")
+        run_render_jobs(render_jobs, max_workers=RENDER_WORKERS if PARALLEL_RENDER else 0)
+
+    if CLEAN_UP:
+        if os.path.exists(PRED_PATH):
+            print("Deleting forecast...")
+            os.remove(PRED_PATH)
+        if os.path.exists(ERROR_LOG_PATH):
+            print("Deleting error log...")
+            os.remove(ERROR_LOG_PATH)
+        if os.path.exists(LEDGER_PATH):
+            print("Deleting sweep ledger...")
+            os.remove(LEDGER_PATH)
+        if os.path.exists(ERROR_DATAPATH):
+            print("Deleting error dataset...")
+            os.remove(ERROR_DATAPATH)
+        if os.path.exists(stats_cache_path(ERROR_DATAPATH)):
+            os.remove(stats_cache_path(ERROR_DATAPATH))
+        for directory in [ERROR_DIR, REGENERATED_DIR, SHARD_DIR]:
+            if os.path.exists(directory):
+                print(f"Deleting {directory}...")
+                shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import numpy as np
+from datetime import datetime, timedelta
+from generate_forecast import run_inference, run_batched_inference, get_device
+from compute_error import compute_true_track, record_member_errors, compute_cumulative_error
+from model_registry import get_cached_model
+from rollout_sinks import HurricaneTrackSink, NetCDFSink
+from capture import CaptureSpec
+from member_retention import MemberRetention, retained_member_path
+from ensemble_store import create_ensemble_store, ZarrMemberSink
+from forecast_cache import (
+    ForecastCache, forecast_spec, forecast_key, track_artifact, retained_artifact, save_track, load_track, link_file
+)
+from tracing import traced
+from config import *
+
+# create the ensemble store full fields are written to (only used when SAVE_FULL_FIELDS is on)
+def create_sweep_store(model):
+    times = [datetime(2018, 9, 13, 0, 0) + timedelta(hours=6 * t) for t in range(TIMESTEPS)]
+    create_ensemble_store(
+        ENSEMBLE_STORE_PATH, NOISE_PCTS, NUM_EXPERIMENTS, times, model.out_channel_names, model.grid.lat, model.grid.lon
+    )
+
+# what a member keeps of its forecast in RETAINED_DIR: RETAIN_CHANNELS, only over the local window with RETAIN_WINDOW,
+# or everything for the FULL_CAPTURE_MEMBERS
+def retain_capture(member_idx):
+    if member_idx in FULL_CAPTURE_MEMBERS:
+        return CaptureSpec()
+    return CaptureSpec(channels=RETAIN_CHANNELS, window=(y_min, y_max, x_min, x_max) if RETAIN_WINDOW else None, halo=RETAIN_HALO)
+
+# the tracker always comes first so its errors can be read back from sinks[0]
+def make_member_sinks(noise_pct, seed, member_idx, true_lats, true_lons, model):
+    sinks = [HurricaneTrackSink(true_lats, true_lons, model.out_channel_names)]
+    if SAVE_FULL_FIELDS:
+        sinks.append(ZarrMemberSink(ENSEMBLE_STORE_PATH, NOISE_PCTS.index(noise_pct), member_idx, seed))
+    if RETAIN_MEMBERS:
+        sinks.append(NetCDFSink(
+            retained_member_path(noise_pct, seed), model.out_channel_names, model.grid.lat, model.grid.lon,
+            capture=retain_capture(member_idx)
+        ))
+    return sinks
+
+# cache entries a member's results are kept in: its track and (with RETAIN_MEMBERS) its retained output
+def member_artifacts(member_idx):
+    artifacts = {"track": track_artifact(y_min, y_max, x_min, x_max)}
+    if RETAIN_MEMBERS:
+        artifacts["retained"] = retained_artifact(retain_capture(member_idx))
+    return artifacts
+
+# (track lats, track lons, retained output path) of a cached member, with its retained output linked into place, or None
+def load_cached_member(cache, key, noise_pct, seed, member_idx):
+    artifacts = member_artifacts(member_idx)
+    track = load_track(cache, key, artifacts["track"])
+    if track is None:
+        return None
+    path = None
+    if RETAIN_MEMBERS:
+        cached_path = cache.get(key, artifacts["retained"])
+        if cached_path is None:
+            return None
+        path = retained_member_path(noise_pct, seed)
+        link_file(cached_path, path)
+    return list(track[0]), list(track[1]), path
+
+def cache_member(cache, key, member_idx, sinks):
+    artifacts = member_artifacts(member_idx)
+    if RETAIN_MEMBERS:
+        cache.put(key, artifacts["retained"], sinks[-1].path)
+    track = sinks[0]
+    save_track(cache, key, artifacts["track"], track.track_lats, track.track_lons, track.track_pressures)
+
+# run every seed at one noise level, tracking the hurricane in-flight, and record cumulative errors in error_log
+# (and in the ledger, if given) as soon as each batch of members finishes
+# seeds are all the level's seeds (they fix each member's index); members limits the run to some of them.
+# with CACHE_FORECASTS, members already in the forecast cache aren't run again, and members that must give the same
+# forecast (all seeds without noise) are only run once. full fields aren't cached, so SAVE_FULL_FIELDS runs everything
+@traced
+def run_noise_level(error_log, noise_pct, seeds, true_lats, true_lons, retention=None, ledger=None, members=None):
+    model = get_cached_model(MODEL_DIR, get_device())
+    member_idx = {seed: idx for idx, seed in enumerate(seeds)}
+    members = seeds if members is None else members
+    pending = [seed for seed in members if ledger is None or not ledger.is_done(noise_pct, seed)]
+    if len(pending) < len(members):
+        print(f"Skipping {len(members) - len(pending)} finished members with noise {noise_pct}")
+    make_sinks = lambda seed: make_member_sinks(noise_pct, seed, member_idx[seed], true_lats, true_lons, model)
+
+    # members: {seed: (track lats, track lons, retained output path)}
+    def finish_members(members):
+        # errors of all finished members in one vectorized call, shape (members, time)
+        all_errors = compute_cumulative_error(
+            true_lats, true_lons, np.array([member[0] for member in members.values()]), np.array([member[1] for member in members.values()])
+        )
+        for (seed, (_, _, path)), cumulative_errors in zip(members.items(), all_errors):
+            record_member_errors(error_log, noise_pct, seed, cumulative_errors)
+            if retention is not None:
+                retention.add(noise_pct, seed, cumulative_errors[-1], path)
+            # recorded last: a member in the ledger is never run again, so everything else about it must be done
+            if ledger is not None:
+                ledger.record(noise_pct, seed, cumulative_errors)
+
+    cache = ForecastCache() if CACHE_FORECASTS and not SAVE_FULL_FIELDS else None
+    keys, duplicates = {}, {}
+    if cache is not None:
+        cached = {}
+        for seed in pending:
+            keys[seed] = forecast_key(forecast_spec(PERTURBATION, noise_pct, seed=seed))
+            member = load_cached_member(cache, keys[seed], noise_pct, seed, member_idx[seed])
+            if member is not None:
+                cached[seed] = member
+        if cached:
+            print(f"Reusing {len(cached)} cached members with noise {noise_pct}")
+            finish_members(cached)
+        # one member runs for each distinct key (and retained capture), the others are read back from its cache entry
+        # once it's done
+        runs = {}
+        for seed in pending:
+            if seed not in cached:
+                runs.setdefault((keys[seed], *member_artifacts(member_idx[seed]).values()), []).append(seed)
+        pending = [same_key[0] for same_key in runs.values()]
+        duplicates = {same_key[0]: same_key[1:] for same_key in runs.values()}
+
+    def finish_rollouts(member_sinks):
+        members = {}
+        for seed, sinks in member_sinks.items():
+            members[seed] = (sinks[0].track_lats, sinks[0].track_lons, sinks[-1].path if RETAIN_MEMBERS else None)
+            if cache is not None:
+                cache_member(cache, keys[seed], member_idx[seed], sinks)
+                # a duplicate has the same forecast, so it's made from this member's results (which may be evicted
+                # from the cache already)
+                for duplicate in duplicates[seed]:
+                    path = None
+                    if RETAIN_MEMBERS:
+                        path = retained_member_path(noise_pct, duplicate)
+                        link_file(sinks[-1].path, path)
+                    members[duplicate] = (sinks[0].track_lats, sinks[0].track_lons, path)
+        finish_members(members)
+
+    if not pending:
+        return
+    if BATCH_MEMBERS:
+        print(f"Generating {len(pending)} forecasts with noise {noise_pct}...")
+        run_batched_inference(
+            noise_prop=noise_pct, seeds=pending, make_sinks=make_sinks, on_batch_done=finish_rollouts, mode=PERTURBATION
+        )
+    else:
+        for seed in pending:
+            print(f"Generating forecast with noise {noise_pct} and seed {seed}...")
+            sinks = make_sinks(seed)
+            run_inference(mode=PERTURBATION, noise_prop=noise_pct, seed=seed, sinks=sinks, save_output=False)
+            finish_rollouts({seed: sinks})
+
+# what a sweep's ledger must agree on to be resumed or merged (see ExperimentLedger)
+def sweep_description():
+    perturbation = PERTURBATION if PERTURBATION == "noise" else f"{PERTURBATION} {CORRELATION_LENGTH_KM} km"
+    return {
+        "noise_pcts": NOISE_PCTS, "num_experiments": NUM_EXPERIMENTS, "noise_rng": NOISE_RNG, "perturbation": perturbation,
+        "seeds": SEEDS
+    }
+
+# every experiment of the sweep as (noise_idx, member_idx, seed), in sweep order. seeds is the same list in every
+# process (see SWEEP_SEED), so any process can work out any part of the sweep from it
+def experiment_grid(seeds=SEEDS, num_noise_levels=len(NOISE_PCTS), num_experiments=NUM_EXPERIMENTS):
+    return [
+        (noise_idx, member_idx, seeds[noise_idx * num_experiments + member_idx])
+        for noise_idx in range(num_noise_levels) for member_idx in range(num_experiments)
+    ]
+
+# run all NOISE_PCTS x NUM_EXPERIMENTS members (or only the given experiments from experiment_grid) and fill in
+# error_log. with a ledger, its seeds are used and members already in it are skipped
+def run_noise_sweep(error_log, ledger=None, retention=None, experiments=None):
+    true_lats, true_lons = compute_true_track(TRUE_PATH, TIMESTEPS)
+    if retention is None and RETAIN_MEMBERS:
+        retention = MemberRetention()
+    if SAVE_FULL_FIELDS:
+        create_sweep_store(get_cached_model(MODEL_DIR, get_device()))
+    seeds = ledger.sweep["seeds"] if ledger is not None else SEEDS
+    if experiments is None:
+        experiments = experiment_grid(seeds)
+    for noise_idx, noise_pct in enumerate(NOISE_PCTS):
+        members = [seed for idx, _, seed in experiments if idx == noise_idx]
+        if members:
+            level_seeds = seeds[noise_idx * NUM_EXPERIMENTS:(noise_idx + 1) * NUM_EXPERIMENTS]
+            run_noise_level(error_log, noise_pct, level_seeds, true_lats, true_lons, retention, ledger, members)
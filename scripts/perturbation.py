@@ -0,0 +1,156 @@
+import math
+import numpy as np
+import torch
+from config import SPECTRAL_BATCH
+
+# Counter-based (Philox4x32-10) Gaussian noise for initial condition perturbations.
+# Every value is a pure function of (seed, member, channel, grid index): the seed is the Philox key and the rest
+# is its counter, so noise is generated straight on the device, one channel at a time, without any global RNG state,
+# and any member's noise can be regenerated for a few channels or a region without producing the whole field.
+# Each counter gives 4 uint32s -> 4 normals (two Box-Muller pairs) for 4 consecutive grid points.
+# torch has no uint32 multiply with a 64-bit result, so values are kept in int64 and multiplied in 16-bit halves.
+
+PHILOX_M0, PHILOX_M1 = 0xD2511F53, 0xCD9E8D57   # round multipliers
+PHILOX_W0, PHILOX_W1 = 0x9E3779B9, 0xBB67AE85   # key schedule (Weyl) constants
+PHILOX_ROUNDS = 10
+MASK32 = 0xFFFFFFFF
+NOISE_STREAM = 0        # last counter word: which kind of perturbation the values are drawn for
+CORRELATED_STREAM = 1
+
+# (hi, lo) 32-bit halves of m * x for a uint32 constant m and an int64 tensor x of uint32 values
+def _mulhilo32(m, x):
+    low = m * (x & 0xFFFF)      # < 2^48
+    high = m * (x >> 16)        # < 2^48
+    carry = (low >> 16) + high  # < 2^49
+    return carry >> 16, ((carry & 0xFFFF) << 16) | (low & 0xFFFF)
+
+# Philox4x32 with a 2 x 32-bit key. counter: 4 int64 tensors (or ints) of uint32 values that broadcast together
+def philox4x32(counter, key, rounds=PHILOX_ROUNDS):
+    c0, c1, c2, c3 = counter
+    k0, k1 = key[0] & MASK32, key[1] & MASK32
+    for _ in range(rounds):
+        hi0, lo0 = _mulhilo32(PHILOX_M0, c0)
+        hi1, lo1 = _mulhilo32(PHILOX_M1, c2)
+        c0, c1, c2, c3 = hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0
+        k0, k1 = (k0 + PHILOX_W0) & MASK32, (k1 + PHILOX_W1) & MASK32
+    return c0, c1, c2, c3
+
+# uint32 -> uniform on (0, 1), never 0 so the log in Box-Muller is finite
+def _uniform(x, dtype):
+    return ((x >> 8).to(dtype) + 0.5) * 2. ** -24
+
+# N(0, 1) values of the 4 grid points of each counter block (int64 tensor), shape (blocks, 4)
+def _block_normals(seed, member, channel, blocks, stream=NOISE_STREAM):
+    zeros = torch.zeros_like(blocks)
+    words = philox4x32((blocks, zeros + channel, zeros + member, zeros + stream), (seed, seed >> 32))
+    normals = []
+    for first, second in [(words[0], words[1]), (words[2], words[3])]:
+        radius = torch.sqrt(-2. * torch.log(_uniform(first, torch.float32)))
+        angle = (2. * math.pi) * _uniform(second, torch.float32)
+        normals += [radius * torch.cos(angle), radius * torch.sin(angle)]
+    return torch.stack(normals, dim=-1)
+
+# N(0, 1) values of the grid points with flat indices index (int64 tensor) of one channel of one member
+def philox_normal(seed, member, channel, index, dtype=torch.float32, stream=NOISE_STREAM):
+    index = torch.as_tensor(index, dtype=torch.int64)
+    normals = _block_normals(seed, member, channel, index >> 2, stream)
+    return normals.gather(-1, (index & 3)[..., None])[..., 0].to(dtype)
+
+# N(0, 1) values of all num_points grid points of one channel of one member (same values as philox_normal)
+def philox_normal_field(seed, member, channel, num_points, device="cpu", dtype=torch.float32, stream=NOISE_STREAM):
+    blocks = torch.arange((num_points + 3) // 4, device=device)
+    return _block_normals(seed, member, channel, blocks, stream).reshape(-1)[:num_points].to(dtype)
+
+# noise of one member, shape (channels, lat, lon), for all channels (num_channels) or the given channel indices and,
+# optionally, only a region (y_min, y_max, x_min, x_max) of the (num_lat, num_lon) grid. matches the same slice of the
+# full field exactly
+def member_noise(seed, member=0, channels=None, region=None, num_channels=73, grid_shape=(721, 1440), device="cpu", dtype=torch.float32):
+    num_lat, num_lon = grid_shape
+    y_min, y_max, x_min, x_max = region if region is not None else (0, num_lat, 0, num_lon)
+    channels = range(num_channels) if channels is None else channels
+    rows = torch.arange(y_min, y_max, device=device)
+    cols = torch.arange(x_min, x_max, device=device)
+    index = (rows[:, None] * num_lon + cols[None, :]).reshape(-1)   # flat grid index of each point in the region
+    noise = torch.empty((len(channels), y_max - y_min, x_max - x_min), device=device, dtype=dtype)
+    for i, channel in enumerate(channels):
+        if region is None:
+            values = philox_normal_field(seed, member, channel, num_lat * num_lon, device, dtype)
+        else:
+            values = philox_normal(seed, member, channel, index, dtype)
+        noise[i] = values.reshape(y_max - y_min, x_max - x_min)
+    return noise
+
+# add noise_prop * stds[c] * N(0, 1) to each channel c of one member's state x (channels, lat, lon), in place, on x's
+# device and in x's dtype. only one channel of noise exists at a time
+def add_member_noise(x, noise_prop, stds, seed, member=0):
+    num_lat, num_lon = x.shape[-2:]
+    scale = np.asarray(stds, dtype=np.float64).reshape(-1) * noise_prop   # host-side, so no device sync per channel
+    for channel in range(x.shape[0]):
+        noise = philox_normal_field(seed, member, channel, num_lat * num_lon, x.device, x.dtype).reshape(num_lat, num_lon)
+        x[channel].add_(noise, alpha=float(scale[channel]))
+    return x
+
+# Spatially correlated noise: white Philox noise (stream CORRELATED_STREAM) shaped in spectral space so that its
+# correlation between points r km apart is exp(-r^2 / (2 L^2)), with unit variance. FFTs run on batches of
+# (member, channel) fields at once, and filters are cached per grid and length scale.
+# Distances are measured on the lat-lon grid with the spacing at the equator, so L is exact north-south everywhere
+# and east-west at the equator (east-west correlation spans fewer km towards the poles). The grid is periodic in
+# longitude; in latitude it is padded by 4 L so the FFT doesn't correlate the north pole with the south pole.
+
+KM_PER_DEGREE = 111.195
+_SPECTRAL_FILTERS = {}
+
+def padded_rows(grid_shape, length_km):
+    num_lat, _ = grid_shape
+    km_per_row = KM_PER_DEGREE * 180. / (num_lat - 1)
+    return num_lat + int(math.ceil(4 * length_km / km_per_row))
+
+# rfft2 filter of the padded grid, scaled so the filtered field has unit variance (cached)
+def spectral_filter(grid_shape, length_km, device="cpu"):
+    key = (tuple(grid_shape), float(length_km), str(device))
+    if key in _SPECTRAL_FILTERS:
+        return _SPECTRAL_FILTERS[key]
+    num_lat, num_lon = grid_shape
+    num_rows = padded_rows(grid_shape, length_km)
+    km_per_cell = KM_PER_DEGREE * 360. / num_lon
+    ky = 2 * math.pi * torch.fft.fftfreq(num_rows, d=km_per_cell, device=device, dtype=torch.float64)
+    kx = 2 * math.pi * torch.fft.fftfreq(num_lon, d=km_per_cell, device=device, dtype=torch.float64)
+    # |filter|^2 is the spectrum of the correlation function, exp(-k^2 L^2 / 2). with orthonormal FFTs the variance of
+    # the result is the mean of |filter|^2 over the full spectrum, which is separable in ky and kx
+    variance = torch.exp(-ky ** 2 * length_km ** 2 / 2).mean() * torch.exp(-kx ** 2 * length_km ** 2 / 2).mean()
+    kx = kx[:num_lon // 2 + 1].abs()    # rfft2 keeps the non-negative kx only
+    amplitude = torch.exp(-(ky[:, None] ** 2 + kx[None, :] ** 2) * length_km ** 2 / 4) / torch.sqrt(variance)
+    _SPECTRAL_FILTERS[key] = amplitude.to(torch.float32)
+    return _SPECTRAL_FILTERS[key]
+
+# correlated fields of (seed, member, channel) triples, shape (len(fields), lat, lon), yielded batch_size at a time
+def correlated_batches(fields, length_km, grid_shape=(721, 1440), device="cpu", batch_size=SPECTRAL_BATCH):
+    num_lat, num_lon = grid_shape
+    num_rows = padded_rows(grid_shape, length_km)
+    spectral = spectral_filter(grid_shape, length_km, device)
+    for start in range(0, len(fields), batch_size):
+        white = torch.stack([
+            philox_normal_field(seed, member, channel, num_rows * num_lon, device, stream=CORRELATED_STREAM)
+            for seed, member, channel in fields[start:start + batch_size]
+        ]).reshape(-1, num_rows, num_lon)
+        shaped = torch.fft.irfft2(torch.fft.rfft2(white, norm="ortho") * spectral, s=(num_rows, num_lon), norm="ortho")
+        yield shaped[:, :num_lat]
+
+# correlated noise of one member, shape (channels, lat, lon), for all channels or the given channel indices
+def correlated_noise(seed, length_km, member=0, channels=None, num_channels=73, grid_shape=(721, 1440), device="cpu", dtype=torch.float32):
+    channels = range(num_channels) if channels is None else channels
+    fields = [(seed, member, channel) for channel in channels]
+    return torch.cat(list(correlated_batches(fields, length_km, grid_shape, device))).to(dtype)
+
+# add noise_prop * stds[c] * correlated noise to each channel c of a batch of members x (members, channels, lat, lon)
+# in place, member i drawn from seeds[i]. FFTs are batched across members and channels
+def add_correlated_noise(x, noise_prop, stds, seeds, length_km, member=0):
+    scale = np.asarray(stds, dtype=np.float64).reshape(-1) * noise_prop
+    targets = [(i, channel) for i in range(len(seeds)) for channel in range(x.shape[1])]
+    fields = [(seeds[i], member, channel) for i, channel in targets]
+    done = 0
+    for batch in correlated_batches(fields, length_km, tuple(x.shape[-2:]), x.device):
+        for (i, channel), values in zip(targets[done:done + len(batch)], batch):
+            x[i, channel].add_(values.to(x.dtype), alpha=float(scale[channel]))
+        done += len(batch)
+    return x
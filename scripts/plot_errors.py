@@ -4,10 +4,11 @@ import os
 from tqdm import tqdm
 from compute_error import *
 from utils import units
-from load_data import load_dataset, get_channel_data
-from scipy.stats import skew, kurtosis
+from error_stats import get_channel_stats, STATS_PERCENTILES
+from tracing import traced
 from config import x_min, x_max, y_min, y_max, TIMESTEPS
 
+@traced
 def plot_tracking_error_vs_time_given_noise(plot_dir, error_log, noise_pct):
     plt.figure(figsize=(10, 6))
     
@@ -30,10 +31,12 @@ def plot_tracking_error_vs_time_given_noise(plot_dir, error_log, noise_pct):
     plt.savefig(os.path.join(plot_dir, f"noise{int(noise_pct * 100.):02d}_cumulative_error_vs_time.png"))
     plt.close()
 
+@traced
 def plot_tracking_error_vs_time_all_noise(plot_dir, error_log):
     for noise_pct in error_log:
         plot_tracking_error_vs_time_given_noise(plot_dir, error_log, noise_pct)
 
+@traced
 def plot_tracking_error_vs_noise(plot_dir, error_log):
     plt.figure(figsize=(10, 6))
     noise_pcts = np.array(list(error_log.keys())) * 100.
@@ -63,28 +66,17 @@ def plot_tracking_error_vs_noise(plot_dir, error_log):
     plt.savefig(os.path.join(plot_dir, "total_error_vs_noise.png"))
     plt.close()
 
+@traced
 def plot_pixelwise_error_hists(plot_dir, error_datapath, channel, num_steps, title, filename_prefix, mode='global'):
     os.makedirs(plot_dir, exist_ok = True)
-    ds = load_dataset(error_datapath)
-    data = get_channel_data(ds, channel)
-
-    # set boundaries
-    data_np = data.values
-    max_abs_first = np.percentile(np.abs(data_np[0]), 99)
-    max_abs_last = np.percentile(np.abs(data_np[-1]), 99)
-    max_abs = max(max_abs_first, max_abs_last)
-    hist_range = (-max_abs, max_abs)
+    stats = get_channel_stats(error_datapath, channel, mode)   # histograms are precomputed with fixed bins
 
     # only plot 1st and last timesteps
     for t, color in zip([0, num_steps-1], ['#6be0f2', '#79f26b']): # alternate darker colors: ['#1029e6', '#126608']
-        errors_t = data.isel(time=t).values
-        if mode.lower()[0] == 'l':  # if in local mode, limit data
-            errors_t = errors_t[y_min:y_max, x_min:x_max]
-        errors_t = errors_t.flatten()
-
         # plot histogram
         plt.figure(figsize=(10,6))
-        plt.hist(errors_t, bins=100, range=hist_range, color=color, edgecolor="black")
+        edges = stats["hist_edges"]
+        plt.hist(edges[:-1], bins=edges, weights=stats["hist_counts"][t], color=color, edgecolor="black")
         plt.xlabel(f"Prediction Error ({units(channel)})")
         plt.ylabel("Pixel Count")
         plt.title(title)
@@ -96,31 +88,19 @@ def plot_pixelwise_error_hists(plot_dir, error_datapath, channel, num_steps, tit
         plt.close()
 
 # create plot of summary statistics (max, 95th percentile, ..., min) for a given experiment over all timesteps
+@traced
 def plot_pixelwise_error_summary(plot_dir, error_datapath, channel, num_steps, title, filename, mode='global'):
     os.makedirs(plot_dir, exist_ok = True)
-    ds = load_dataset(error_datapath)
-    data = get_channel_data(ds, channel)
+    stats = get_channel_stats(error_datapath, channel, mode)
     
-    max_vals = []
-    p95_vals = []
-    p75_vals = []
-    median_vals = []
-    p25_vals = []
-    p5_vals = []
-    min_vals = []
-    for t in range(num_steps):
-        errors_t = data.isel(time=t).values
-        if mode.lower()[0] == 'l': # if in local mode, limit the data to central atlantic region
-            errors_t = errors_t[y_min:y_max, x_min:x_max]
-        errors_t = errors_t.flatten()
-        
-        max_vals.append(np.max(errors_t))
-        p95_vals.append(np.percentile(errors_t, 95))
-        p75_vals.append(np.percentile(errors_t, 75))
-        median_vals.append(np.percentile(errors_t, 50))
-        p25_vals.append(np.percentile(errors_t, 25))
-        p5_vals.append(np.percentile(errors_t, 5))
-        min_vals.append(np.min(errors_t))
+    percentiles = {q: stats["percentiles"][:num_steps, i] for i, q in enumerate(STATS_PERCENTILES)}
+    max_vals = percentiles[100]
+    p95_vals = percentiles[95]
+    p75_vals = percentiles[75]
+    median_vals = percentiles[50]
+    p25_vals = percentiles[25]
+    p5_vals = percentiles[5]
+    min_vals = percentiles[0]
 
     x_axis = np.arange(num_steps) * 6
     plt.figure(figsize=(10,6))
@@ -166,25 +146,15 @@ def plot_pixelwise_error_summary(plot_dir, error_datapath, channel, num_steps, t
     plt.close()
 
 # create plots of mean, std, skew, kurtosis and save to plot_dir
+@traced
 def plot_pixelwise_error_moments(plot_dir, error_datapath, channel, num_steps, title, filename, mode='global'):
     os.makedirs(plot_dir, exist_ok = True)
-    ds = load_dataset(error_datapath)
-    data = get_channel_data(ds, channel)
+    stats = get_channel_stats(error_datapath, channel, mode)
     
-    mean_vals = []
-    std_vals = []
-    skew_vals = []
-    kurt_vals = []
-    for t in range(num_steps):
-        errors_t = data.isel(time=t).values
-        if mode.lower()[0] == 'l':
-            errors_t = errors_t[y_min:y_max, x_min:x_max]
-        errors_t = errors_t.flatten()
-        
-        mean_vals.append(np.mean(errors_t))
-        std_vals.append(np.std(errors_t))
-        skew_vals.append(skew(errors_t))
-        kurt_vals.append(kurtosis(errors_t))
+    mean_vals = stats["mean"][:num_steps]
+    std_vals = stats["std"][:num_steps]
+    skew_vals = stats["skew"][:num_steps]
+    kurt_vals = stats["kurtosis"][:num_steps]
     
     fig, axs = plt.subplots(4, 1, figsize=(8,8), sharex=True)
     x_axis = np.arange(num_steps) * 6
@@ -1,59 +1,79 @@
 import os
 from generate_forecast import run_inference
 from compute_error import generate_global_error_dataset
-from visualize_forecast import animate_frames, visualize_global
+from error_stats import load_error_stats, stats_cache_path
+from visualize_forecast import visualize_global
+from animation_sink import AnimationSink
 from plot_errors import plot_pixelwise_error_hists, plot_pixelwise_error_summary, plot_pixelwise_error_moments
 from config import *
 
-for distribution in DISTRIBUTIONS:  # repeat for each distribution
-    if PREDICT:
-        print(f"Generating forecast from {distribution} initial conditions...")
-        run_inference(mode="random", distribution=distribution, verbose=True)
+# the whole random-mode pipeline, kept out of module level like noise_mode_pipeline.main
+def main():
+    for distribution in DISTRIBUTIONS:  # repeat for each distribution
+        if PREDICT:
+            print(f"Generating forecast from {distribution} initial conditions...")
+            run_inference(mode="random", distribution=distribution, verbose=True)
 
-    if VISUALIZE_GLOBAL:
-        plot_dir = os.path.join(GLOBAL_PRED_PLOT_DIR, "random", distribution)
-        print(f"Plotting forecast in {plot_dir}...")
-        for channel in CHANNELS:
-            visualize_global(
-                plot_dir, PRED_PATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
-                title_prefix = f"FourCastNetv2 prediction from {distribution} - {channel}", 
-                filename_prefix = f"{channel}_prediction_{distribution}"
-            )
-            animate_frames(os.path.join(plot_dir, channel), animation_name=f"animated_prediction_{channel}_{distribution}.gif")
+        if VISUALIZE_GLOBAL:
+            plot_dir = os.path.join(GLOBAL_PRED_PLOT_DIR, "random", distribution)
+            print(f"Plotting forecast in {plot_dir}...")
+            for channel in CHANNELS:
+                channel_dir = os.path.join(plot_dir, channel)
+                with AnimationSink(
+                    os.path.join(channel_dir, f"animated_prediction_{channel}_{distribution}.gif"),
+                    frame_dir = os.path.join(channel_dir, "frames") if SAVE_FRAMES else None
+                ) as animation_sink:
+                    visualize_global(
+                        plot_dir, PRED_PATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
+                        title_prefix = f"FourCastNetv2 prediction from {distribution} - {channel}", 
+                        filename_prefix = f"{channel}_prediction_{distribution}",
+                        animation_sink = animation_sink
+                    )
 
-    if PLOT_ERROR_GLOBAL:
-        generate_global_error_dataset(ERROR_DATAPATH, TRUE_PATH, PRED_PATH)
-        plot_dir = os.path.join(GLOBAL_ERR_PLOT_DIR, "random", distribution)
-        print(f"Plotting error in {plot_dir}...")
-        for channel in CHANNELS:
-            visualize_global(
-                plot_dir, ERROR_DATAPATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
-                title_prefix = f"FourCastNetv2 Hurricane Florence Prediction Error - {distribution} distribution - {channel}", 
-                filename_prefix = f"{channel}_error_{distribution}",
-                is_error_plot = True
-            )
-            animate_frames(os.path.join(plot_dir, channel), animation_name=f"animated_error_{channel}_{distribution}.gif")
-            plot_pixelwise_error_hists(
-                os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS,
-                title = f"Global {channel} error histogram - {distribution}",
-                filename_prefix = f"{channel}_error_hist_{distribution}"
-            )
-            plot_pixelwise_error_summary(
-                os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
-                title = f"Global {channel} error summary - {distribution}", 
-                filename = f"{channel}_error_summary_{distribution}"
-            )
-            plot_pixelwise_error_moments(
-                os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
-                title = distribution, 
-                filename = f"Global {channel} error moments - {distribution}"
-            )
+        if PLOT_ERROR_GLOBAL:
+            generate_global_error_dataset(ERROR_DATAPATH, TRUE_PATH, PRED_PATH)
+            load_error_stats(ERROR_DATAPATH, CHANNELS)  # one pass over the errors, the error plots read the cached stats
+            plot_dir = os.path.join(GLOBAL_ERR_PLOT_DIR, "random", distribution)
+            print(f"Plotting error in {plot_dir}...")
+            for channel in CHANNELS:
+                channel_dir = os.path.join(plot_dir, channel)
+                with AnimationSink(
+                    os.path.join(channel_dir, f"animated_error_{channel}_{distribution}.gif"),
+                    frame_dir = os.path.join(channel_dir, "frames") if SAVE_FRAMES else None
+                ) as animation_sink:
+                    visualize_global(
+                        plot_dir, ERROR_DATAPATH, channel, TIMESTEPS, ERA5_STATS_DIR, 
+                        title_prefix = f"FourCastNetv2 Hurricane Florence Prediction Error - {distribution} distribution - {channel}", 
+                        filename_prefix = f"{channel}_error_{distribution}",
+                        is_error_plot = True,
+                        animation_sink = animation_sink
+                    )
+                plot_pixelwise_error_hists(
+                    os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS,
+                    title = f"Global {channel} error histogram - {distribution}",
+                    filename_prefix = f"{channel}_error_hist_{distribution}"
+                )
+                plot_pixelwise_error_summary(
+                    os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
+                    title = f"Global {channel} error summary - {distribution}", 
+                    filename = f"{channel}_error_summary_{distribution}"
+                )
+                plot_pixelwise_error_moments(
+                    os.path.join(plot_dir, channel), ERROR_DATAPATH, channel, TIMESTEPS, 
+                    title = distribution, 
+                    filename = f"Global {channel} error moments - {distribution}"
+                )
 
-if CLEAN_UP:
-    if os.path.exists(PRED_PATH):
-        print("Deleting forecast...")
-        os.remove(PRED_PATH)
-    if os.path.exists(ERROR_DATAPATH):
-        print("Deleting error dataset...")
-        os.remove(ERROR_DATAPATH)
-    
\ No newline at end of file
+    if CLEAN_UP:
+        if os.path.exists(PRED_PATH):
+            print("Deleting forecast...")
+            os.remove(PRED_PATH)
+        if os.path.exists(ERROR_DATAPATH):
+            print("Deleting error dataset...")
+            os.remove(ERROR_DATAPATH)
+        if os.path.exists(stats_cache_path(ERROR_DATAPATH)):
+            os.remove(stats_cache_path(ERROR_DATAPATH))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import matplotlib
+matplotlib.use("Agg")  # workers never show figures
+import matplotlib.pyplot as plt
+from tqdm import tqdm
+from tracing import trace_span
+from config import RENDER_WORKERS, RENDER_WORKER_MEMORY_GB, RENDER_TASKS_PER_WORKER
+
+# Runs plotting/animation work as independent jobs on a pool of worker processes.
+# matplotlib and cartopy aren't thread-safe, so every job runs in its own process; a job only starts once all the
+# jobs it depends on (e.g. every frame of a GIF) have finished, and jobs depending on a failed job are skipped.
+
+class RenderJob:
+    def __init__(self, name, func, args=(), kwargs=None, deps=()):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.deps = list(deps)
+
+    def run(self):
+        with trace_span(self.name, cat="render"):
+            return self.func(*self.args, **self.kwargs)
+
+# cap the address space of each worker so one runaway plot can't take down the whole node
+def _limit_worker_memory(memory_gb):
+    if memory_gb is not None:
+        limit = int(memory_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _run_job(job):
+    try:
+        return job.run()
+    finally:
+        plt.close('all')
+
+# jobs whose dependencies have all finished and that haven't been started yet
+def _ready_jobs(jobs, started, done):
+    return [job for job in jobs if job.name not in started and all(dep in done for dep in job.deps)]
+
+# run all jobs respecting dependencies. with max_workers=0 everything runs in this process, in dependency order
+def run_render_jobs(jobs, max_workers=RENDER_WORKERS, worker_memory_gb=RENDER_WORKER_MEMORY_GB,
+                    tasks_per_worker=RENDER_TASKS_PER_WORKER, desc="Rendering"):
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Render job names must be unique.")
+    missing = {dep for job in jobs for dep in job.deps} - set(names)
+    if missing:
+        raise ValueError(f"Render jobs depend on unknown jobs: {sorted(missing)}")
+
+    started, done, failed = set(), set(), {}
+    progress = tqdm(total=len(jobs), desc=desc)
+
+    # a job can never run if anything it depends on failed (or was skipped itself)
+    def skip_blocked():
+        blocked = [job for job in jobs if job.name not in started and any(dep in failed for dep in job.deps)]
+        for job in blocked:
+            started.add(job.name)
+            failed[job.name] = "skipped because a dependency failed"
+            progress.update(1)
+        return blocked
+
+    if max_workers == 0:
+        while len(started) < len(jobs):
+            ready = _ready_jobs(jobs, started, done)
+            if not ready and not skip_blocked():
+                raise ValueError("Render jobs have a dependency cycle.")
+            for job in ready:
+                started.add(job.name)
+                try:
+                    job.run()
+                    done.add(job.name)
+                except Exception as e:
+                    failed[job.name] = repr(e)
+                progress.update(1)
+    else:
+        # workers are recycled by starting a fresh pool every tasks_per_worker jobs per worker, so leaked figures
+        # and fragmented memory don't pile up (max_tasks_per_child can deadlock the pool on older Pythons)
+        while len(started) < len(jobs):
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),  # don't fork a parent that may hold CUDA state
+                initializer=_limit_worker_memory,
+                initargs=(worker_memory_gb,),
+            )
+            with executor:
+                running = {}
+                submitted = 0
+                while running or (len(started) < len(jobs) and submitted < max_workers * tasks_per_worker):
+                    for job in _ready_jobs(jobs, started, done)[:max_workers * tasks_per_worker - submitted]:
+                        started.add(job.name)
+                        running[executor.submit(_run_job, job)] = job
+                        submitted += 1
+                    if not running:
+                        if not skip_blocked():
+                            raise ValueError("Render jobs have a dependency cycle.")
+                        continue
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        job = running.pop(future)
+                        try:
+                            future.result()
+                            done.add(job.name)
+                        except Exception as e:
+                            failed[job.name] = repr(e)
+                        progress.update(1)
+                    skip_blocked()
+    progress.close()
+
+    if failed:
+        details = "\n".join(f"  {name}: {error}" for name, error in failed.items())
+        raise RuntimeError(f"{len(failed)} of {len(jobs)} render jobs failed:\n{details}")
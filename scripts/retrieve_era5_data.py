@@ -1,98 +1,148 @@
-import cdsapi
 import os
-import xarray as xr
-from config import DATA_PATH, TRUE_PATH
+import argparse
+from config import DATA_PATH, TRUE_PATH, PRESSURE_LEVELS
 from load_data import load_dataset
+from netcdf_writer import ForecastNetCDFWriter
+from tracing import traced
 
-def retrieve_era5_data():
-    c = cdsapi.Client()
-    
-    # retrieve pressure level data
-    c.retrieve(
-        'reanalysis-era5-complete',
-        {
-            'class': 'ea',
-            'date': '2018-09-13/to/2018-09-16',
-            'expver': '1',
-            'levelist': '1000/925/850/700/600/500/400/300/250/200/150/100/50',  # Pressure levels in hPa
-            'levtype': 'pl',  # pressure levels
-            'param': '129/130/131/132/157',  # u, v, z, t, r 
-            'stream': 'oper',
-            'type': 'an',  # analysis
-            'grid': '0.25/0.25',  # 0.25-degree resolution
-            'time': [
-                '00:00', '06:00', '12:00', '18:00',
-            ],
-            'area': [90, 0, -90, 359.75], # global data
-            'format': 'netcdf',
-        },
-        os.path.join(DATA_PATH, 'era5_pl.nc')
-    )
-    
-    # retrieve surface level data
-    c.retrieve(
-        'reanalysis-era5-complete',
-        {
-            'class': 'ea',
-            'date': '2018-09-13/to/2018-09-16',
-            'expver': '1',
-            'levtype': 'sfc',  # surface variables
-            'param': '134/137/151/165/166/167/228246/228247',  # u10m, v10m, u100m, v100m, t2m, sp, msl, tcwv
-            'stream': 'oper',
-            'type': 'an',  # analysis
-            'grid': '0.25/0.25',  # 0.25-degree resolution
-            'time': [
-                '00:00', '06:00', '12:00', '18:00',
-            ],
-            'area': [90, 0, -90, 359.75], # global data
-            'format': 'netcdf',
-        },
-        os.path.join(DATA_PATH, 'era5_sfc.nc')
-    )
+# Download the ERA5 pressure-level and surface fields of the forecast period and convert them into TRUE_PATH, laid out
+# like FCNv2 input/output: (time, channel, latitude, longitude) with channels in FCNv2 order.
+# Downloads that are already on disk (and readable, with every variable and time) are not requested again, and the
+# conversion copies one (time, channel) field at a time, so memory stays at one 721 x 1440 field.
+
+ERA5_DATES = '2018-09-13/to/2018-09-16'
+ERA5_TIMES = ['00:00', '06:00', '12:00', '18:00']
+NUM_ERA5_TIMES = 16     # 4 days x 4 analyses
+
+ERA5_REQUESTS = {
+    "era5_pl.nc": {
+        'class': 'ea',
+        'date': ERA5_DATES,
+        'expver': '1',
+        'levelist': '1000/925/850/700/600/500/400/300/250/200/150/100/50',  # Pressure levels in hPa
+        'levtype': 'pl',  # pressure levels
+        'param': '129/130/131/132/157',  # u, v, z, t, r
+        'stream': 'oper',
+        'type': 'an',  # analysis
+        'grid': '0.25/0.25',  # 0.25-degree resolution
+        'time': ERA5_TIMES,
+        'area': [90, 0, -90, 359.75], # global data
+        'format': 'netcdf',
+    },
+    "era5_sfc.nc": {
+        'class': 'ea',
+        'date': ERA5_DATES,
+        'expver': '1',
+        'levtype': 'sfc',  # surface variables
+        'param': '134/137/151/165/166/167/228246/228247',  # u10m, v10m, u100m, v100m, t2m, sp, msl, tcwv
+        'stream': 'oper',
+        'type': 'an',  # analysis
+        'grid': '0.25/0.25',  # 0.25-degree resolution
+        'time': ERA5_TIMES,
+        'area': [90, 0, -90, 359.75], # global data
+        'format': 'netcdf',
+    },
+}
+
+# ERA5 variable of each file, in FCNv2 channel order: all surface vars, then each pressure-level var on every level
+SURFACE_VARS = ['u10', 'v10', 'u100', 'v100', 't2m', 'sp', 'msl', 'tcwv']
+PRESSURE_VARS = ['u', 'v', 'z', 't', 'r']
+ERA5_VARIABLES = {"era5_pl.nc": PRESSURE_VARS, "era5_sfc.nc": SURFACE_VARS}
+
+# FCNv2 channel names (variable names adjusted to match)
+def fcnv2_channel_names(levels=PRESSURE_LEVELS):
+    return ['u10m', 'v10m', 'u100m', 'v100m', 't2m', 'sp', 'msl', 'tcwv'] + [f"{var}{lev}" for var in PRESSURE_VARS for lev in levels]
+
+# newer CDS files call the time dimension valid_time and the level dimension pressure_level
+def _dim_name(ds, names):
+    return next(name for name in names if name in ds.dims)
 
-    surface_ds = load_dataset(os.path.join(DATA_PATH, "era5_sfc.nc"))
-    pressure_ds = load_dataset(os.path.join(DATA_PATH, "era5_pl.nc"))
-    
-    # rename time dimension to match FCNv2
-    surface_ds = surface_ds.rename({'valid_time': 'time'})
-    pressure_ds = pressure_ds.rename({'valid_time': 'time'})
-    
-    # rearrange and merge datasets into a single dataset matching the configuration of FCNv2 input/output
-    levels = [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000]
-    
-    # each variable in order, starting with all surface vars. note that variable names will be adjusted to match FCNv2 channels
-    ordered_vars = [surface_ds[var] for var in ['u10', 'v10', 'u100', 'v100', 't2m', 'sp', 'msl', 'tcwv']]
-    
-    for var in ['u', 'v', 'z', 't', 'r']:
-        arr = pressure_ds[var].sel(pressure_level=levels)
-        for lev in levels:
-            single_level = arr.sel(pressure_level=lev).assign_coords(pressure_level=None).expand_dims("channel")
-            ordered_vars.append(single_level)
-    
-    data_array = xr.concat(ordered_vars, dim='channel')
-    data_array = data_array.transpose('time', 'channel', 'latitude', 'longitude')  # ensure correct order (time, channel, lat, lon)
-    tensor = data_array.values
-    print("tensor shape:", tensor.shape)
-    
-    # adjust names to match FCNv2 channels
-    channel_names = [
-        'u10m', 'v10m', 'u100m', 'v100m', 't2m', 'sp', 'msl', 'tcwv'
-    ] + [f"{var}{lev}" for var in ['u', 'v', 'z', 't', 'r'] for lev in levels]
-    
-    # reconstruct data array with correct names
-    data_xr = xr.DataArray(
-        tensor,
-        dims=["time", "channel", "latitude", "longitude"],
-        coords={
-            "time": surface_ds.time,
-            "channel": channel_names,
-            "latitude": surface_ds.latitude,
-            "longitude": surface_ds.longitude,
-        },
-        name="forecast"
+# a file is usable if it opens and has every variable at every time (a download cut short fails one of these)
+def is_valid_era5_file(path, variables, num_times=NUM_ERA5_TIMES):
+    if not os.path.exists(path):
+        return False
+    try:
+        ds = load_dataset(path)
+    except (OSError, ValueError):
+        return False
+    try:
+        return all(var in ds for var in variables) and ds.sizes[_dim_name(ds, ["valid_time", "time"])] >= num_times
+    except StopIteration:
+        return False
+    finally:
+        ds.close()
+
+# make sure both raw files are in data_dir, requesting only the ones missing (or broken) from the CDS.
+# client is anything with cdsapi.Client's retrieve(name, request, target), e.g. a local stand-in
+@traced
+def download_era5(client=None, data_dir=DATA_PATH):
+    paths = {}
+    for filename, request in ERA5_REQUESTS.items():
+        path = os.path.join(data_dir, filename)
+        paths[filename] = path
+        if is_valid_era5_file(path, ERA5_VARIABLES[filename]):
+            print(f"Using cached {path}")
+            continue
+        if client is None:
+            import cdsapi   # only needed when something has to be downloaded
+            client = cdsapi.Client()
+        os.makedirs(data_dir, exist_ok=True)
+        part_path = path + ".part"  # so an interrupted download is never mistaken for a finished one
+        client.retrieve('reanalysis-era5-complete', request, part_path)
+        if not is_valid_era5_file(part_path, ERA5_VARIABLES[filename]):
+            raise ValueError(f"downloaded {filename} is missing variables or times")
+        os.replace(part_path, path)
+    return paths["era5_pl.nc"], paths["era5_sfc.nc"]
+
+# (dataset, variable, selection) of each FCNv2 channel, in channel order
+def channel_sources(pressure_ds, surface_ds, levels=PRESSURE_LEVELS):
+    sources = [(surface_ds, var, {}) for var in SURFACE_VARS]
+    level_dim = _dim_name(pressure_ds, ["pressure_level", "level"])
+    for var in PRESSURE_VARS:
+        sources += [(pressure_ds, var, {level_dim: lev}) for lev in levels]
+    return sources
+
+# convert the raw ERA5 files into output_path, one (time, channel) field at a time
+@traced
+def convert_era5(pl_path, sfc_path, output_path=TRUE_PATH, levels=PRESSURE_LEVELS):
+    pressure_ds = load_dataset(pl_path)
+    surface_ds = load_dataset(sfc_path)
+    pl_time, sfc_time = _dim_name(pressure_ds, ["valid_time", "time"]), _dim_name(surface_ds, ["valid_time", "time"])
+    times = surface_ds[sfc_time].values
+    channel_names = fcnv2_channel_names(levels)
+    sources = channel_sources(pressure_ds, surface_ds, levels)
+
+    writer = ForecastNetCDFWriter(
+        output_path, channel_names, surface_ds.latitude.values, surface_ds.longitude.values,
+        lat_name="latitude", lon_name="longitude"
     )
-    
-    ds = data_xr.to_dataset()
-    print("Available channels:", ds.channel.values)
-    
-    ds.to_netcdf(TRUE_PATH)
\ No newline at end of file
+    try:
+        for t, time in enumerate(times):
+            writer.set_time(t, time)
+            for channel_idx, (ds, var, selection) in enumerate(sources):
+                time_dim = pl_time if ds is pressure_ds else sfc_time
+                field = ds[var].sel({time_dim: time, **selection}).squeeze(drop=True)    # drops size-1 dims like expver
+                writer.write_channel(t, channel_idx, field.transpose('latitude', 'longitude').values)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        pressure_ds.close()
+        surface_ds.close()
+    writer.close()
+    print(f"Wrote {len(times)} times x {len(channel_names)} channels to {output_path}")
+
+# download (if needed) and convert. output_path is left alone if it's newer than both raw files
+def retrieve_era5_data(client=None, data_dir=DATA_PATH, output_path=TRUE_PATH):
+    pl_path, sfc_path = download_era5(client, data_dir)
+    if os.path.exists(output_path) and os.path.getmtime(output_path) > max(os.path.getmtime(pl_path), os.path.getmtime(sfc_path)):
+        print(f"Using existing {output_path}")
+        return
+    convert_era5(pl_path, sfc_path, output_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download ERA5 (if needed) and convert it into the FCNv2 input file.")
+    parser.add_argument("--data-dir", default=DATA_PATH, help="where era5_pl.nc and era5_sfc.nc are (or are downloaded to)")
+    parser.add_argument("--output", default=TRUE_PATH)
+    args = parser.parse_args()
+    retrieve_era5_data(data_dir=args.data_dir, output_path=args.output)
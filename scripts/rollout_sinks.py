@@ -0,0 +1,83 @@
+from geodesic_distance import track_errors
+from netcdf_writer import ForecastNetCDFWriter
+from capture import CaptureSpec, captured_grid
+from track_hurricane import track_storm
+from config import x_min, x_max, y_min, y_max
+
+# Sinks consume a rollout one model step at a time, while the iterator is still running.
+# run_inference and run_batched_inference call sink.consume(step, time, output) for every step, where output is
+# a single member's (channel, lat, lon) tensor still on the inference device, then sink.finalize() once at the end.
+# A sink can split consume into select(step, output), which cuts out the part of the step it needs while it's still on
+# the device (or returns None to skip the step), and write(step, time, data), which handles that part (on the host or
+# the device). SinkPipeline then copies only the selected part to the host and runs write on its writer thread (see
+# sink_pipeline.py).
+
+# track the hurricane (min msl in the local window) on the fly; errors against the true track are computed in one go
+# once the track is complete
+class HurricaneTrackSink:
+    def __init__(self, true_lats, true_lons, channel_names):
+        self.true_lats = true_lats
+        self.true_lons = true_lons
+        self.msl_idx = list(channel_names).index("msl")
+        self.track_lats = []
+        self.track_lons = []
+        self.track_pressures = []   # central pressure (min msl) at each step
+
+    def select(self, step, output):
+        return output[self.msl_idx, y_min:y_max, x_min:x_max]
+
+    # window is tracked where it is (on the device when consumed directly), only the track point is copied back
+    def write(self, step, time, window):
+        lat, lon, pressure = track_storm(window, y_min, x_min)
+        self.track_lats.append(float(lat))
+        self.track_lons.append(float(lon))
+        self.track_pressures.append(float(pressure))
+
+    def consume(self, step, time, output):
+        self.write(step, time, self.select(step, output))
+
+    def finalize(self):
+        pass
+
+    # same values compute_cumulative_error gives for this member
+    def cumulative_errors(self):
+        steps = len(self.track_lats)
+        return track_errors(self.true_lats[:steps], self.true_lons[:steps], self.track_lats, self.track_lons)[1]
+
+# write the forecast of one member to a NetCDF file, one step at a time.
+# capture (a CaptureSpec) limits what's written to some channels, a window of the grid, and/or some lead times; it's
+# cut out on the device, so the rest never leaves it
+class NetCDFSink:
+    def __init__(self, path, channel_names, lat, lon, capture=None):
+        self.path = path
+        self.capture = capture or CaptureSpec()
+        self.channel_idx = self.capture.channel_indices(channel_names)
+        self.rows, self.cols = self.capture.grid_slices(len(lat), len(lon))
+        self.num_written = 0
+        self.writer = ForecastNetCDFWriter(
+            path, self.capture.channels or channel_names, *captured_grid(self.capture, lat, lon),
+            attrs=self.capture.file_attrs(len(lat), len(lon))
+        )
+
+    def select(self, step, output):
+        if not self.capture.captures(step):
+            return None
+        if self.channel_idx is None:
+            return output[:, self.rows, self.cols]
+        return output[self.channel_idx, self.rows, self.cols]
+
+    def write(self, step, time, data):
+        self.writer.write_step(self.num_written, time, data.cpu().numpy())
+        self.num_written += 1
+
+    def consume(self, step, time, output):
+        data = self.select(step, output)
+        if data is not None:
+            self.write(step, time, data)
+
+    def finalize(self):
+        self.writer.close()
+
+    # drop the partial file (for rollouts that fail part-way)
+    def abort(self):
+        self.writer.abort()
@@ -0,0 +1,151 @@
+import queue
+import threading
+import torch
+from tracing import trace_span
+from config import ASYNC_SINKS, SINK_QUEUE_STEPS
+
+# Runs the sinks of a rollout (see rollout_sinks.py) on a writer thread, so copying each step to the host, tracking and
+# writing to disk overlap the model computing the next step.
+# consume(step, time, output) takes a whole (member, channel, lat, lon) step. Each sink's part of each member is cut out
+# on the device (sink.select, or the whole member for sinks without one; sinks that select None skip the step) and, on
+# CUDA, copied into pinned host buffers on a side stream, so the copy doesn't queue up behind the next step's kernels.
+# The writer thread waits for the copy and hands the host tensors to sink.write (sink.consume for sinks without select).
+# On the CPU the selected parts are handed over as they are, which relies on the model yielding a new tensor every step
+# (earth2mip's iterators do).
+# At most max_pending steps wait for the writer; past that consume blocks until it catches up, so host memory stays at
+# max_pending + 2 steps of selected data however long the rollout.
+# An exception in a sink stops all writing and is raised again from the next consume or from close. Used as a context
+# manager, the sinks are finalized when the block completes and aborted (partial files dropped) when it raises.
+# max_pending=0 calls the sinks inline, exactly as consuming each member directly.
+
+def _select(sink, step, output):
+    select = getattr(sink, "select", None)
+    return output if select is None else select(step, output)
+
+def _write(sink, step, time, data):
+    if hasattr(sink, "select"):
+        sink.write(step, time, data)
+    else:
+        sink.consume(step, time, data)
+
+class SinkPipeline:
+    def __init__(self, member_sinks, device, max_pending=SINK_QUEUE_STEPS if ASYNC_SINKS else 0):
+        self.targets = [(member_idx, sink) for member_idx, sinks in enumerate(member_sinks) for sink in sinks]
+        self.max_pending = max_pending
+        self.error = None
+        self.aborted = False
+        self.thread = None
+        if max_pending <= 0 or not self.targets:
+            return
+        self.use_cuda = torch.device(device).type == "cuda"
+        if self.use_cuda:
+            self.device = torch.device(device)
+            self.copy_stream = torch.cuda.Stream(self.device)
+            self.free_buffers = queue.Queue()
+            self.num_buffers = 0
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._drain, name="sink writer", daemon=True)
+        self.thread.start()
+
+    def consume(self, step, time, output):
+        self._raise_error()
+        if self.thread is None:
+            for member_idx, sink in self.targets:
+                sink.consume(step, time, output[member_idx])
+            return
+        if self.use_cuda:
+            selected, buffers, copied = self._copy_to_host(step, output)
+        else:
+            selected, buffers, copied = [_select(sink, step, output[member_idx]) for member_idx, sink in self.targets], None, None
+        self.queue.put((step, time, selected, buffers, copied))   # blocks while max_pending steps are waiting
+
+    # pinned buffers of a step: reused once the writer is done with them, new ones only until max_pending + 2 exist
+    def _take_buffers(self):
+        try:
+            return self.free_buffers.get_nowait()
+        except queue.Empty:
+            if self.num_buffers < self.max_pending + 2:
+                self.num_buffers += 1
+                return [None] * len(self.targets)
+            return self.free_buffers.get()
+
+    # (host tensor of each sink, or None if it skips the step, pinned buffers they're in, event set once they're filled)
+    def _copy_to_host(self, step, output):
+        buffers = self._take_buffers()
+        selected = []
+        ready = torch.cuda.Event()
+        ready.record(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.copy_stream):
+            self.copy_stream.wait_event(ready)  # the step is computed
+            for i, (member_idx, sink) in enumerate(self.targets):
+                data = _select(sink, step, output[member_idx])
+                if data is None:
+                    selected.append(None)
+                    continue
+                if buffers[i] is None or buffers[i].shape != data.shape or buffers[i].dtype != data.dtype:
+                    buffers[i] = torch.empty(data.shape, dtype=data.dtype, pin_memory=True)
+                buffers[i].copy_(data, non_blocking=True)
+                selected.append(buffers[i])
+            output.record_stream(self.copy_stream)  # keeps the step's memory from being reused before it's copied
+            copied = torch.cuda.Event()
+            copied.record(self.copy_stream)
+        return selected, buffers, copied
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            step, time, selected, buffers, copied = item
+            try:
+                # after an error (or abort) steps are only taken off the queue, so consume never blocks for good
+                if self.error is None and not self.aborted:
+                    with trace_span("write step", cat="sinks", step=step):
+                        if copied is not None:
+                            copied.synchronize()
+                        for (member_idx, sink), data in zip(self.targets, selected):
+                            if data is not None:
+                                _write(sink, step, time, data)
+            except BaseException as e:
+                self.error = e
+            finally:
+                if buffers is not None:
+                    self.free_buffers.put(buffers)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("a rollout sink failed on the writer thread") from self.error
+
+    def _stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    # wait for the writer to catch up, then finalize every sink
+    def close(self):
+        self._stop()
+        self._raise_error()
+        for member_idx, sink in self.targets:
+            sink.finalize()
+
+    # drop whatever is still queued and abort the sinks that can be
+    def abort(self):
+        self.aborted = True
+        self._stop()
+        for member_idx, sink in self.targets:
+            if hasattr(sink, "abort"):
+                sink.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.close()
+            except BaseException:
+                self.abort()
+                raise
+        else:
+            self.abort()
@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import torch
+from noise_sweep import experiment_grid, run_noise_sweep, sweep_description
+from experiment_ledger import ExperimentLedger, read_ledger
+from compute_error import record_member_errors
+from member_retention import MemberRetention, load_retention_index, save_retention_index, merge_retention_indices
+from ic_store import open_ic_store
+from load_data import update_json
+from config import *
+
+# Sharded noise sweep: the NOISE_PCTS x NUM_EXPERIMENTS grid (experiment_grid) is the same in every process, so it
+# can be split between workers that never talk to each other. Each worker keeps its own ledger and retention index
+# in SHARD_DIR, and `merge` combines them into the usual error log and retention index afterwards.
+#   python sweep_runner.py launch --processes 4                  # split the sweep across local processes (one GPU each)
+#   python sweep_runner.py run --shard 2 --num-shards 8          # run one fixed shard, e.g. one per node
+#   python sweep_runner.py queue --worker node07                 # pull units from the queue in QUEUE_DIR (shared storage)
+#   python sweep_runner.py merge                                 # write ERROR_LOG_PATH and RETAINED_INDEX_PATH
+
+# experiments of one shard; round robin, so every shard gets members of every noise level in sweep order
+def shard_experiments(grid, shard_idx, num_shards):
+    if not 0 <= shard_idx < num_shards:
+        raise ValueError(f"shard {shard_idx} out of range for {num_shards} shards")
+    return grid[shard_idx::num_shards]
+
+def shard_ledger_path(worker_name, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f"{worker_name}.jsonl")
+
+def shard_index_path(worker_name, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f"{worker_name}.retained.json")
+
+# run the experiments select(grid) picks from the sweep's experiment grid, recording them in this worker's ledger and
+# retention index. the grid is made from the ledger's seeds, like run_noise_sweep does
+def run_experiments(worker_name, select, resume=RESUME):
+    open_ic_store(TRUE_PATH)
+    ledger = ExperimentLedger(sweep_description(), path=shard_ledger_path(worker_name), resume=resume)
+    experiments = select(experiment_grid(ledger.sweep["seeds"]))
+    print(f"Worker {worker_name} running {len(experiments)} members...")
+    retention = None
+    if RETAIN_MEMBERS:
+        if not resume and os.path.exists(shard_index_path(worker_name)):
+            os.remove(shard_index_path(worker_name))
+        retention = MemberRetention(index_path=shard_index_path(worker_name))
+    run_noise_sweep(ledger.error_log, ledger, retention, experiments)
+
+def run_shard(shard_idx, num_shards, resume=RESUME):
+    print(f"Running shard {shard_idx} of {num_shards}...")
+    run_experiments(f"shard{shard_idx:03d}", lambda grid: shard_experiments(grid, shard_idx, num_shards), resume)
+
+# work units of the queue: QUEUE_UNIT_SIZE consecutive members of one noise level, named by their position in the grid
+def queue_units(grid, unit_size=QUEUE_UNIT_SIZE):
+    units = {}
+    for noise_idx, member_idx, seed in grid:
+        name = f"noise{noise_idx:02d}_unit{member_idx // unit_size:04d}"
+        units.setdefault(name, []).append((noise_idx, member_idx, seed))
+    return units
+
+# claim a unit by creating its claim file; O_EXCL makes this atomic on local and NFS storage alike. a claim older than
+# stale_hours is moved aside (only one worker's rename can succeed) and the unit is claimed again
+def claim_unit(name, worker_name, queue_dir=QUEUE_DIR, stale_hours=QUEUE_STALE_HOURS):
+    claim_path = os.path.join(queue_dir, f"{name}.claim")
+    if os.path.exists(os.path.join(queue_dir, f"{name}.done")):
+        return False
+    for _ in range(2):
+        try:
+            fd = os.open(claim_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                age_hours = (time.time() - os.path.getmtime(claim_path)) / 3600
+                if age_hours < stale_hours:
+                    return False
+                os.rename(claim_path, f"{claim_path}.stale.{worker_name}.{os.getpid()}")
+                print(f"Taking over {name}, abandoned {age_hours:.1f} hours ago")
+            except FileNotFoundError:   # finished, or taken over by another worker in the meantime
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{worker_name} {socket.gethostname()} {os.getpid()}\n")
+        return True
+    return False
+
+def finish_unit(name, queue_dir=QUEUE_DIR):
+    with open(os.path.join(queue_dir, f"{name}.done"), "w"):
+        pass
+
+# keep claiming and running units until none are left (units claimed by live workers are left to them)
+def run_queue(worker_name, resume=RESUME):
+    os.makedirs(QUEUE_DIR, exist_ok=True)
+    for name in queue_units(experiment_grid()):
+        if not claim_unit(name, worker_name):
+            continue
+        print(f"Worker {worker_name} claimed {name}")
+        run_experiments(worker_name, lambda grid: queue_units(grid)[name], resume)
+        resume = True   # later units append to the same ledger
+        finish_unit(name)
+    print(f"Worker {worker_name}: no unclaimed units left.")
+
+# run num_processes shards as local subprocesses, spread over the visible GPUs
+def launch_shards(num_processes, resume=RESUME):
+    num_devices = torch.cuda.device_count()
+    processes = []
+    for shard_idx in range(num_processes):
+        env = dict(os.environ)
+        if num_devices > 0:
+            env["CUDA_VISIBLE_DEVICES"] = str(shard_idx % num_devices)
+        cmd = [sys.executable, os.path.abspath(__file__), "run", "--shard", str(shard_idx), "--num-shards", str(num_processes)]
+        if not resume:
+            cmd.append("--restart")
+        processes.append(subprocess.Popen(cmd, env=env))
+    failed = [shard_idx for shard_idx, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f"sweep shards {failed} failed; rerun with RESUME to finish them.")
+
+# combine every worker's ledger and retention index in SHARD_DIR. members are put in sweep order (first result wins if a
+# member was run twice), so the error log and the best/median/worst picks match a single-process sweep
+def merge_shards(shard_dir=SHARD_DIR):
+    ledger_paths = sorted(os.path.join(shard_dir, f) for f in os.listdir(shard_dir) if f.endswith(".jsonl"))
+    results = {}
+    for path in ledger_paths:
+        sweep, records = read_ledger(path)
+        if sweep is None:
+            continue
+        if sweep != sweep_description():
+            raise ValueError(f"{path} belongs to a different sweep.")
+        for record in records:
+            results.setdefault((record["noise_pct"], record["seed"]), record["errors"])
+
+    error_log = {}
+    for noise_idx, _, seed in experiment_grid():
+        noise_pct = NOISE_PCTS[noise_idx]
+        if (noise_pct, seed) in results:
+            record_member_errors(error_log, noise_pct, seed, results[(noise_pct, seed)])
+    num_members = sum(len(seed2error) for seed2error in error_log.values())
+    if num_members < len(SEEDS):
+        print(f"Warning: only {num_members} of {len(SEEDS)} members are finished.")
+
+    if RETAIN_MEMBERS:
+        index_paths = [path[:-len(".jsonl")] + ".retained.json" for path in ledger_paths]
+        indices = [load_retention_index(path) for path in index_paths if os.path.exists(path)]
+        save_retention_index(merge_retention_indices(indices, SEEDS))
+    return error_log
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the noise sweep in shards across processes or nodes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run one shard of the sweep")
+    run_parser.add_argument("--shard", type=int, required=True)
+    run_parser.add_argument("--num-shards", type=int, required=True)
+    queue_parser = subparsers.add_parser("queue", help="run units from the shared work queue until none are left")
+    queue_parser.add_argument("--worker", default=f"{socket.gethostname()}-{os.getpid()}")
+    launch_parser = subparsers.add_parser("launch", help="run the sweep in local processes, then merge")
+    launch_parser.add_argument("--processes", type=int, default=SWEEP_PROCESSES)
+    subparsers.add_parser("merge", help="combine the shard results into ERROR_LOG_PATH")
+    for subparser in [run_parser, queue_parser, launch_parser]:
+        subparser.add_argument("--restart", action="store_true", help="ignore results of an earlier run (default: RESUME)")
+    args = parser.parse_args()
+
+    resume = RESUME and not getattr(args, "restart", False)
+    if args.command == "run":
+        run_shard(args.shard, args.num_shards, resume)
+    elif args.command == "queue":
+        run_queue(args.worker, resume)
+    elif args.command == "launch":
+        open_ic_store(TRUE_PATH)    # build the shared store once, before the workers start
+        launch_shards(args.processes, resume)
+    if args.command in ["launch", "merge"]:
+        update_json(ERROR_LOG_PATH, merge_shards())
@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import torch
+from datetime import datetime, timedelta
+from netcdf_writer import ForecastNetCDFWriter
+from retrieve_era5_data import fcnv2_channel_names
+from config import PRESSURE_LEVELS
+
+# Synthetic stand-ins for the ERA5 input and the FCNv2 weights, so every stage of the pipeline can run offline on a CPU
+# (see benchmark.py). The truth file has the size and layout retrieve_era5_data.py produces, (time, 73, 721, 1440) with
+# channels in FCNv2 order, filled with smooth per-channel fields at roughly ERA5's mean and spread plus a low pressure
+# system that drifts through the local window, so tracking and the plots have a storm to follow.
+# SyntheticModel implements the part of the earth2mip model contract the scripts rely on: model(time, x) iterates
+# (time, output, restart) starting with the initial state, plus out_channel_names and grid.lat / grid.lon.
+
+GRID_SHAPE = (721, 1440)
+START_TIME = datetime(2018, 9, 13, 0, 0)
+STEP_HOURS = 6
+
+STORM_START = (32., 285.)   # lat, lon (degrees east) of the storm center at the first time, inside the local window
+STORM_DRIFT = (0.4, -0.5)   # degrees lat, lon the storm moves per step
+STORM_DEPTH = 4000.         # Pa below the surrounding msl / sp
+STORM_RADIUS = 2.           # degrees
+
+# (mean, std) of the surface channels; pressure-level channels get theirs from synthetic_level_stats
+SURFACE_STATS = {
+    "u10m": (0., 5.), "v10m": (0., 5.), "u100m": (0., 6.), "v100m": (0., 6.),
+    "t2m": (280., 20.), "sp": (97000., 9000.), "msl": (101000., 1100.), "tcwv": (20., 15.),
+}
+
+# FCNv2 grid: 90 to -90 degrees north, 0 to 359.75 degrees east
+def synthetic_grid(grid_shape=GRID_SHAPE):
+    num_lat, num_lon = grid_shape
+    return np.linspace(90, -90, num_lat), np.arange(num_lon) * 360. / num_lon
+
+# rough (mean, std) of a pressure-level variable: standard atmosphere heights and temperatures
+def synthetic_level_stats(var, level):
+    height = 44331. * (1 - (level / 1013.25) ** 0.19)
+    return {
+        "u": (0., 12.), "v": (0., 9.), "z": (9.81 * height, 1000.),
+        "t": (max(288. - 0.0065 * height, 217.), 15.), "r": (50., 30.),
+    }[var]
+
+# per-channel means and stds shaped like the global_means.npy / global_stds.npy FCNv2 ships with, (1, 73, 1, 1)
+def synthetic_stats(levels=PRESSURE_LEVELS):
+    stats = [SURFACE_STATS[name] for name in SURFACE_STATS]
+    stats += [synthetic_level_stats(var, level) for var in ["u", "v", "z", "t", "r"] for level in levels]
+    stats = np.array(stats, dtype=np.float32)
+    return stats[:, 0].reshape(1, -1, 1, 1), stats[:, 1].reshape(1, -1, 1, 1)
+
+def write_synthetic_stats(stats_dir):
+    means, stds = synthetic_stats()
+    os.makedirs(stats_dir, exist_ok=True)
+    np.save(os.path.join(stats_dir, "global_means.npy"), means)
+    np.save(os.path.join(stats_dir, "global_stds.npy"), stds)
+
+# smooth large-scale pattern of one channel at time index t, shape (lat, lon)
+def synthetic_field(t, channel_idx, mean, std, lat, lon):
+    phase = 0.7 * channel_idx
+    rows = np.sin(2 * np.deg2rad(lat) + phase)
+    cols = np.cos(3 * np.deg2rad(lon) + 0.1 * t + phase)
+    return (mean + 0.5 * std * rows[:, None] * cols[None, :]).astype(np.float32)
+
+# pressure drop of the storm at time index t, shape (lat, lon)
+def storm_field(t, lat, lon):
+    center_lat = STORM_START[0] + STORM_DRIFT[0] * t
+    center_lon = STORM_START[1] + STORM_DRIFT[1] * t
+    dist2 = (lat[:, None] - center_lat) ** 2 + (lon[None, :] - center_lon) ** 2
+    return (STORM_DEPTH * np.exp(-dist2 / (2 * STORM_RADIUS ** 2))).astype(np.float32)
+
+# write num_times steps of synthetic truth to path, one (time, channel) field at a time
+def write_synthetic_truth(path, num_times, grid_shape=GRID_SHAPE):
+    channel_names = fcnv2_channel_names()
+    means, stds = synthetic_stats()
+    lat, lon = synthetic_grid(grid_shape)
+    with ForecastNetCDFWriter(path, channel_names, lat, lon, lat_name="latitude", lon_name="longitude") as writer:
+        for t in range(num_times):
+            writer.set_time(t, START_TIME + timedelta(hours=STEP_HOURS * t))
+            storm = storm_field(t, lat, lon)
+            for channel_idx, name in enumerate(channel_names):
+                field = synthetic_field(t, channel_idx, means[0, channel_idx, 0, 0], stds[0, channel_idx, 0, 0], lat, lon)
+                if name in ["msl", "sp"]:
+                    field -= storm
+                writer.write_channel(t, channel_idx, field)
+
+class SyntheticGrid:
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+# cheap stand-in for FCNv2: every step shifts the whole state one grid point east, so the storm keeps moving (in
+# another direction than in the truth, which gives the tracking errors something to measure)
+class SyntheticModel:
+    def __init__(self, grid_shape=GRID_SHAPE):
+        self.in_channel_names = fcnv2_channel_names()
+        self.out_channel_names = fcnv2_channel_names()
+        self.grid = SyntheticGrid(*synthetic_grid(grid_shape))
+        self.time_step = timedelta(hours=STEP_HOURS)
+
+    def to(self, device):
+        return self
+
+    # x: (batch, 1, channel, lat, lon); yields (time, (batch, channel, lat, lon) state, restart)
+    def __call__(self, time, x):
+        state = x[:, 0]
+        while True:
+            yield time, state, None
+            state = torch.roll(state, 1, dims=-1)
+            time = time + self.time_step
@@ -0,0 +1,211 @@
+import os
+import sys
+import glob
+import json
+import time
+import fcntl
+import atexit
+import resource
+import argparse
+import functools
+import threading
+import contextlib
+import multiprocessing
+from config import TRACE_PATH
+
+# Tracing of pipeline stages as Chrome trace events: the trace file opens in chrome://tracing, https://ui.perfetto.dev
+# or any other viewer of the trace event format. Every span records its wall time and, in its args, the CPU time of
+# the process, bytes read and written (all reads/writes, including ones served by the page cache; memory-mapped reads
+# aren't counted), current and peak RSS, and allocated / peak device memory if CUDA is in use.
+# Tracing is on when TRACE_PATH (FCNV2_TRACE_PATH) is set or after enable_tracing(path), and is inherited by
+# subprocesses and render workers. When it's off, a traced function costs one extra check per call.
+# GPU work is asynchronous, so its time lands in the span that waits for it (e.g. a copy to the host), not where it
+# was launched.
+# Each process appends its events to path.<pid>.part as it goes (so nothing is lost if a worker is killed), and a
+# top-level process merges all parts into path when it exits. Events of later runs are added to an existing trace;
+# delete it to start over, or merge leftover parts by hand:
+#   python tracing.py merge trace.json
+
+_tracer = None
+_NULL_SPAN = contextlib.nullcontext()
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+class Tracer:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.part_path = f"{self.path}.{os.getpid()}.part"
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.part_path, "a")
+        self.emit({"name": "process_name", "ph": "M", "args": {"name": f"{os.path.basename(sys.argv[0]) or 'python'} ({os.getpid()})"}})
+
+    def emit(self, event):
+        event.setdefault("pid", os.getpid())
+        event.setdefault("tid", threading.get_native_id())
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+# bytes read and written by this process so far (linux only)
+def _io_counters():
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        return None
+
+# (allocated, peak allocated) MB of the current CUDA device, if torch is loaded and has touched the GPU
+def _cuda_mb():
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_initialized():
+        return None
+    return torch.cuda.memory_allocated() / 2 ** 20, torch.cuda.max_memory_allocated() / 2 ** 20
+
+class _Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.io = _io_counters()
+        self.cpu = time.process_time()
+        self.ts = time.time_ns() // 1000    # epoch microseconds, comparable across processes
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        args = dict(self.args, cpu_ms=round(1000 * (time.process_time() - self.cpu), 3))
+        io = _io_counters()
+        if io is not None and self.io is not None:
+            args["read_bytes"], args["written_bytes"] = io[0] - self.io[0], io[1] - self.io[1]
+        rss = _rss_mb()
+        args["rss_mb"] = rss
+        args["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        cuda = _cuda_mb()
+        if cuda is not None:
+            args["cuda_mb"], args["cuda_peak_mb"] = cuda
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        self.tracer.emit({"name": self.name, "cat": self.cat, "ph": "X", "ts": self.ts, "dur": round(duration * 1e6, 1), "args": args})
+        memory = {"rss_mb": rss} if cuda is None else {"rss_mb": rss, "cuda_mb": cuda[0]}
+        self.tracer.emit({"name": "memory", "ph": "C", "ts": self.ts + round(duration * 1e6), "args": memory})
+        return False
+
+# context manager timing a block as a span named name; args (json-serializable) are shown with it
+def trace_span(name, cat="pipeline", **args):
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, cat, args)
+
+# decorator tracing every call of a function as a span named after it
+def traced(func):
+    name = func.__qualname__
+    cat = func.__module__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return func(*args, **kwargs)
+        with _Span(tracer, name, cat, {}):
+            return func(*args, **kwargs)
+    return wrapper
+
+def tracing_enabled():
+    return _tracer is not None
+
+# start tracing to path, in this process and in any process it starts from now on
+def enable_tracing(path):
+    global _tracer
+    if _tracer is not None:
+        if _tracer.path == os.path.abspath(path):
+            return
+        disable_tracing()
+    _tracer = Tracer(path)
+    os.environ["FCNV2_TRACE_PATH"] = _tracer.path
+    # worker processes leave the merge to the process that started them
+    if multiprocessing.parent_process() is None:
+        atexit.register(_merge_at_exit, _tracer.path)
+
+# stop tracing and merge what has been recorded into the trace file
+def disable_tracing():
+    global _tracer
+    if _tracer is None:
+        return
+    tracer, _tracer = _tracer, None
+    tracer.close()
+    os.environ.pop("FCNV2_TRACE_PATH", None)
+    if multiprocessing.parent_process() is None:
+        merge_trace(tracer.path)
+
+def _merge_at_exit(path):
+    if _tracer is not None and _tracer.path == path:
+        disable_tracing()
+
+def _is_running(pid):
+    if pid == os.getpid():
+        return False    # this process has stopped tracing by the time it merges
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# add the events of the part files of path to the trace at path (a {"traceEvents": [...]} JSON file) and remove them.
+# parts of processes that are still running are left alone: they're merged when those processes exit
+def merge_trace(path):
+    path = os.path.abspath(path)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)    # processes finishing at the same time merge one after the other
+        events = []
+        if os.path.exists(path):
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+        part_paths = [
+            part_path for part_path in sorted(glob.glob(glob.escape(path) + ".*.part"))
+            if not _is_running(int(part_path[len(path) + 1:-len(".part")]))
+        ]
+        for part_path in part_paths:
+            with open(part_path) as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except json.JSONDecodeError:    # last line of a process killed mid-write
+                        pass
+        tmp_path = path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, path)
+        for part_path in part_paths:
+            os.remove(part_path)
+    return path
+
+if TRACE_PATH:
+    enable_tracing(TRACE_PATH)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the per-process parts of a trace into the trace file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("path")
+    args = parser.parse_args()
+    print(f"Merged trace into {merge_trace(args.path)}")
@@ -1,14 +1,15 @@
 import numpy as np
+import torch
 
-# convert indices to lat/lon
+# convert indices to lat/lon (plain arithmetic, so these work on scalars, arrays, and tensors alike)
 def index_to_lon(x):
     return x/4-360
 
 def index_to_lat(y):
     return 90 - y/4
 
-index_to_lat_vec = np.vectorize(index_to_lat)
-index_to_lon_vec = np.vectorize(index_to_lon)
+index_to_lat_vec = index_to_lat
+index_to_lon_vec = index_to_lon
 
 # convert lat/lon to indices
 def lon_to_index(lon):
@@ -17,23 +18,36 @@ def lon_to_index(lon):
 def lat_to_index(lat):
     return -4*(lat-90)
 
+# y and x index (within the array) and value of the min pressure of each (lat, lon) frame in msl_vals, shape (..., lat, lon).
+# one argmin over the flattened frame picks the first min in row-major order. works on numpy arrays and torch tensors
+def locate_min_pressure(msl_vals):
+    width = msl_vals.shape[-1]
+    if isinstance(msl_vals, torch.Tensor):
+        flat = msl_vals.flatten(start_dim=-2)
+        min_pressure, flat_idx = torch.min(flat, dim=-1)
+        return flat_idx // width, flat_idx % width, min_pressure
+    flat = np.asarray(msl_vals).reshape(*msl_vals.shape[:-2], -1)
+    flat_idx = np.argmin(flat, axis=-1)
+    min_pressure = np.take_along_axis(flat, flat_idx[..., None], axis=-1)[..., 0]
+    return flat_idx // width, flat_idx % width, min_pressure
+
+# track the storm in a batch of msl cubes cut from the global grid at (y_offset, x_offset), shape (..., lat, lon),
+# e.g. (members, time, lat, lon). returns numpy arrays of lat, lon, and central pressure with the leading shape.
+# torch tensors are tracked on their own device; only the track crosses to host memory
+def track_storm(msl_vals, y_offset=0, x_offset=0):
+    y_loc, x_loc, min_pressure = locate_min_pressure(msl_vals)
+    if isinstance(msl_vals, torch.Tensor):
+        y_loc, x_loc, min_pressure = [v.cpu().numpy() for v in (y_loc, x_loc, min_pressure)]
+    return index_to_lat(y_loc + y_offset), index_to_lon(x_loc + x_offset), min_pressure
+
 # find the x and y coord of min pressure
 def track_min_pressure(msl_vals, track_x, track_y):
-    min_pressure = np.min(msl_vals)
-    y_loc = np.where(msl_vals == min_pressure)[0][0]
-    x_loc = np.where(msl_vals == min_pressure)[1][0]
-    track_x.append(x_loc)
-    track_y.append(y_loc)
+    y_loc, x_loc, _ = locate_min_pressure(msl_vals)
+    track_x.append(int(x_loc))
+    track_y.append(int(y_loc))
 
 # create list of indices of min msl positions in true data and predictions
 def track_true_and_pred_locs(true_msl_vals, pred_msl_vals):
-    track_pred_x = []
-    track_pred_y = []
-    track_true_x = []
-    track_true_y = []
-    
-    for true_vals, pred_vals in zip(true_msl_vals, pred_msl_vals):
-        track_min_pressure(true_vals, track_true_x, track_true_y)
-        track_min_pressure(pred_vals, track_pred_x, track_pred_y)
-    
-    return track_true_x, track_true_y, track_pred_x, track_pred_y
\ No newline at end of file
+    track_true_y, track_true_x, _ = locate_min_pressure(true_msl_vals)
+    track_pred_y, track_pred_x, _ = locate_min_pressure(pred_msl_vals)
+    return track_true_x.tolist(), track_true_y.tolist(), track_pred_x.tolist(), track_pred_y.tolist()
@@ -3,10 +3,10 @@ import torch
 import random
 import os
 
-# create a random list of seeds to use for each experiment
-def randomize_seeds(num_seeds):
-    seed_list = np.arange(num_seeds)
-    np.random.shuffle(seed_list)
+# create a random list of seeds to use for each experiment.
+# the shuffle is seeded, so every process (and every node) that imports config agrees on the same list
+def randomize_seeds(num_seeds, shuffle_seed=0):
+    seed_list = np.random.default_rng(shuffle_seed).permutation(num_seeds)
     seed_list = [int(seed) for seed in seed_list]
     return seed_list
 
@@ -46,20 +46,6 @@ def full_name(channel_name):
     elif channel_name[0] == "q": return f"Specific Humidity at {channel_name[1:]} hPa ({units(channel_name)})"
     else: return "Unknown channel."
 
-# Set means and stds in MODEL_DIR to match your synthetic distributions
-def create_synthetic_stats(model_dir, mean=0, std=1):
-    global_means = np.ones((1, 73, 1, 1)) * mean
-    global_stds = np.ones((1, 73, 1, 1)) * std
-    np.save(os.path.join(model_dir, "global_means.npy"), global_means)
-    np.save(os.path.join(model_dir, "global_stds.npy"), global_stds)
-
-# Replace means and stds in MODEL_DIR with the correct data from ERA5_STATS_DIR
-def restore_channel_stats(model_dir, era5_stats_dir):
-    era5_means = np.load(os.path.join(era5_stats_dir, "global_means.npy"))
-    era5_stds = np.load(os.path.join(era5_stats_dir, "global_stds.npy"))
-    np.save(os.path.join(model_dir, "global_means.npy"), era5_means)
-    np.save(os.path.join(model_dir, "global_stds.npy"), era5_stds)
-
 # Calculate the mean and std from given distribution with given parameters
 def calc_mean_and_std_from_distr(distribution='normal', mean=0, std=1, df=1, a=0, b=1):
     if distribution.lower()[0] == 'n': # normal
@@ -74,15 +60,21 @@ def calc_mean_and_std_from_distr(distribution='normal', mean=0, std=1, df=1, a=0
         print("Unknown distribution. Defaulting to N(0,1).")
         return 0., 1.
 
-# rescale the output of FCNv2 to match the era5 distribution for each channel
+# map data normalized with one set of per-channel stats onto another: (x - from_means) / from_stds * to_stds + to_means.
+# works on numpy arrays and torch tensors; stats are scalars or (1, 73, 1, 1) arrays. the result keeps x's dtype (the
+# stats are folded into one scale and shift in float64 first), so float32 data never gets float64 intermediates
+def remap_normalization(x, from_means, from_stds, to_means, to_stds):
+    scale = np.asarray(to_stds, dtype=np.float64) / np.asarray(from_stds, dtype=np.float64)
+    shift = np.asarray(to_means, dtype=np.float64) - np.asarray(from_means, dtype=np.float64) * scale
+    if isinstance(x, torch.Tensor):
+        scale = torch.as_tensor(scale, dtype=x.dtype, device=x.device)
+        shift = torch.as_tensor(shift, dtype=x.dtype, device=x.device)
+    elif np.issubdtype(np.asarray(x).dtype, np.floating):
+        scale, shift = scale.astype(np.asarray(x).dtype), shift.astype(np.asarray(x).dtype)
+    return x * scale + shift
+
+# rescale the output of FCNv2 to match the era5 distribution for each channel (a step at a time is enough)
 def rescale_fcnv2_output(output_array, era5_stats_dir, distr_mean, distr_std):
     era5_means = np.load(os.path.join(era5_stats_dir, "global_means.npy"))
     era5_stds = np.load(os.path.join(era5_stats_dir, "global_stds.npy"))
-    
-    distr_means = np.ones((1, 73, 1, 1)) * distr_mean
-    distr_stds = np.ones((1, 73, 1, 1)) * distr_std
-    
-    normalized = (output_array - distr_means) / distr_stds
-    rescaled = normalized * era5_stds + era5_means
-    
-    return rescaled.astype(np.float32)
\ No newline at end of file
+    return remap_normalization(output_array, distr_mean, distr_std, era5_means, era5_stds).astype(np.float32)